@@ -2,19 +2,26 @@
 
 from pathlib import Path
 from sys import path
-from shlex import split
 from os import environ
+from re import compile as re_compile, escape as re_escape
 
 
 # Settings
 API_KEY_NAMES = {'OpenAIWrapper'}
 API_KEY_FILE = Path(__file__).parent / '.keys'
+COMMENT_CHAR = '#'
 
 
 # Add gramolang package to sys. path
 package_dir = Path(__file__).parent.parent
 if package_dir not in path: path.insert(1, str(package_dir))
 
+from gramolang.common import NAME_VALUE_SEPS
+
+# Name and value separated by first separator or whitespace (whichever first)
+NAME_SEP_PATTERN = re_compile(
+    rf"\s*[{''.join(map(re_escape, NAME_VALUE_SEPS))}]\s*|\s+")
+
 # Load API keys in environment
 if not API_KEY_FILE.is_file():
     raise FileNotFoundError(f"API key file doesn't exist: {API_KEY_FILE}")
@@ -22,11 +29,13 @@ if not API_KEY_FILE.is_file():
 found_key = {name: False for name in API_KEY_NAMES}
 with open(API_KEY_FILE, 'r') as api_key_file:
     for line in api_key_file:
-        tokens = split(line, comments=True)
-        if not tokens: continue
-        elif tokens[0] in API_KEY_NAMES:
-            environ[tokens[0]] = tokens[-1]
-            found_key[tokens[0]] = True
+        line = ' '.join(line.split(COMMENT_CHAR, 1)[0].split())
+        match = NAME_SEP_PATTERN.search(line)
+        if match is None: continue
+        name, value = line[:match.start()], line[match.end():]
+        if name in API_KEY_NAMES and value:
+            environ[name] = value.strip('\'"')
+            found_key[name] = True
 
 for name, found in found_key.items():
     if not found:
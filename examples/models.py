@@ -1,17 +1,54 @@
 """Print OpenAI models based on an API key"""
 
+from operator import attrgetter
+from pathlib import Path
+from datetime import datetime
+from time import time
+from os import replace
+import json
+
 from tabulate import tabulate
 
 import initialize
 from gramolang import OpenAIWrapper
+from gramolang.common import Model
+
+
+# Settings
+CACHE_FILE = Path.home() / '.cache' / 'gramolang' / 'openai_models.json'
+CACHE_TTL = 60 * 60  # Time to live in seconds for cached models
+
+
+def cached_models(api_wrapper: OpenAIWrapper, ttl: float = CACHE_TTL) -> dict[str: Model]:
+    """Return models from cache file (if fresh) or from API (and cache them)"""
+    try:
+        if time() - CACHE_FILE.stat().st_mtime < ttl:
+            return {
+                m['id']: Model(
+                    m['id'],
+                    datetime.fromisoformat(m['created']) if m['created'] else None,
+                    m['owned_by'])
+                for m in json.loads(CACHE_FILE.read_text())}
+    except (OSError, ValueError, KeyError): pass
+
+    models = api_wrapper.all_models()
+    CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = CACHE_FILE.with_suffix('.tmp')
+    tmp_file.write_text(json.dumps([
+        {'id': m.id,
+         'created': m.created.isoformat() if m.created else None,
+         'owned_by': m.owned_by}
+        for m in models.values()]))
+    replace(tmp_file, CACHE_FILE)
+    return models
 
 
 api_wrapper = OpenAIWrapper()
 
-models = api_wrapper.all_models()
-sorted_table = (
-    (i + 1, mid, models[mid].created, models[mid].owned_by)
-    for i, mid in enumerate(sorted(models)))
+models = cached_models(api_wrapper)
+sorted_table = [
+    (i + 1, m.id, m.created, m.owned_by)
+    for i, m in enumerate(sorted(models.values(), key=attrgetter('id')))]
 headers = ('', 'id', 'created', 'owned_by')
 
 print()
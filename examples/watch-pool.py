@@ -3,6 +3,7 @@
 
 from logging import getLogger, basicConfig, INFO, DEBUG
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import initialize
 from gramolang.common import NAME_VERSION as GRAMOLANG_NAME_VERSION
@@ -17,6 +18,7 @@ TIMEOUT = 2 * 60            # Max. time in seconds for one chat completion
 RETRIES = 4                 # Number of times to retries on timeout or rate limit
 STATUS_DELAY = 60 * 60      # Delay in seconds for printing pool status
 LOG_LEVEL = INFO            # Logging level (import from logging)
+EXECUTOR = ThreadPoolExecutor  # Or ProcessPoolExecutor to parse files in parallel
 
 POOL_DIR = Path(__file__).parent / Path(__file__).stem  # Pool directory
 
@@ -29,9 +31,10 @@ else:
     basicConfig(format='%(message)s', datefmt='%X')
 
 # Start pool
-print(GRAMOLANG_NAME_VERSION)
-watch_pool_files(
-    root_dir=POOL_DIR, model=MODEL,
-    timeout=TIMEOUT, retries=RETRIES,
-    max_files=MAX_FILES, max_chats=MAX_CHATS,
-    status_delay=STATUS_DELAY)
+if __name__ == '__main__':
+    print(GRAMOLANG_NAME_VERSION)
+    watch_pool_files(
+        root_dir=POOL_DIR, model=MODEL,
+        timeout=TIMEOUT, retries=RETRIES,
+        max_files=MAX_FILES, max_chats=MAX_CHATS,
+        status_delay=STATUS_DELAY, executor_class=EXECUTOR)
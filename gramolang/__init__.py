@@ -3,8 +3,19 @@
 # TODO: Create complete in text file chat for one conversation based on sheet?
 # TODO: Make UnitTests, at least one for each module
 
+from importlib import import_module
+
 
 # Forwards
 from .common import NAME, NAME_VERSION
-from .wraipi import OpenAIWrapper, AnthropicWrapper
-from .chat import Chat
+
+# Lazy forwards (API clients are only imported on first use)
+_LAZY_FORWARDS = {
+    'OpenAIWrapper': 'wraipi', 'AnthropicWrapper': 'wraipi',
+    'Chat': 'chat', 'complete_many': 'chat'}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_FORWARDS:
+        return getattr(import_module(f".{_LAZY_FORWARDS[name]}", __name__), name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -5,14 +5,20 @@ Even more automatic completions
 from logging import getLogger
 
 from pathlib import Path
-from os import listdir
-from datetime import datetime, timedelta
-from time import sleep
-from concurrent.futures import ThreadPoolExecutor
+from os import DirEntry, scandir, rename, remove, read, close, fsencode
+from os.path import splitext, isfile
+from datetime import datetime
+from time import monotonic
+from select import select
+from socket import socketpair
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from concurrent.futures import Executor, ThreadPoolExecutor
+from queue import SimpleQueue, Empty
 
 from .common import (
     FileType,
-    rmark, now_delta, write_error, write_new_filename)
+    rmark, write_error, ensure_dir, write_new_filename)
 from .wraipi import APIWrapper
 from .chat import Chat
 from .sheet import complete
@@ -27,6 +33,83 @@ IGNORE_DOT_FILE = True          # Ignore system dot (.) files
 module_logger = getLogger(__name__)
 
 
+class DirectoryWatcher:
+    """Wait for files written or moved in a directory, or for a wake up call
+
+    Uses inotify on Linux (wait ends as soon as a file is written or moved in
+    the directory), and falls back to polling on other platforms (wait always
+    reports a possible change). Other threads can end a wait with wake(), sent
+    through a socket pair (select only accepts sockets on Windows).
+    """
+
+    # inotify flags and event masks (see inotify.h, no os.O_* on Windows)
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_ONLYDIR = 0x01000000
+
+    def __init__(self, path: Path) -> None:
+        self.path: Path = path
+        self._fd: int | None = None
+        try:
+            libc = CDLL(find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+            if fd < 0: raise OSError(get_errno(), 'inotify_init1 failed')
+            mask = self._IN_CLOSE_WRITE | self._IN_MOVED_TO | self._IN_ONLYDIR
+            if libc.inotify_add_watch(fd, fsencode(path), mask) < 0:
+                close(fd)
+                raise OSError(get_errno(), 'inotify_add_watch failed')
+            self._fd = fd
+        except (OSError, AttributeError, TypeError):
+            module_logger.debug(f"No inotify for '{path}', fall back to polling")
+
+        # Socket pair to wake up wait
+        self._wake_sockets: tuple | None = socketpair()
+        for sock in self._wake_sockets: sock.setblocking(False)
+
+    def __enter__(self): return self
+
+    def __exit__(self, *args) -> None: self.close()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            close(self._fd)
+            self._fd = None
+        if self._wake_sockets is not None:
+            wake_sockets, self._wake_sockets = self._wake_sockets, None
+            for sock in wake_sockets: sock.close()
+
+    def wake(self) -> None:
+        """End current (or next) wait (thread-safe)"""
+        wake_sockets = self._wake_sockets
+        if wake_sockets is None: return
+        try: wake_sockets[1].send(b'\0')
+        except BlockingIOError: pass  # Buffer full, wait ends anyway
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to timeout seconds or wake up, return True if directory may have changed
+
+        Only a wake up without inotify event returns False: changes inotify
+        doesn't report (e.g. hard links, or files written by other machines on
+        a network share) are found on timeout, as when polling.
+        """
+        wake_socket = self._wake_sockets[0]
+        fds = (wake_socket,) if self._fd is None else (self._fd, wake_socket)
+        ready = select(fds, (), (), timeout)[0]
+        if wake_socket in ready:
+            try:
+                while wake_socket.recv(4096): pass
+            except BlockingIOError: pass
+        if self._fd is None or not ready: return True
+        if self._fd in ready:
+            try:
+                while read(self._fd, 4096): pass
+            except BlockingIOError: pass
+            return True
+        return False
+
+
 def validate(file_type: FileType):
     if file_type in (FileType.TEXT, FileType.CSV):
         raise Exception(f"{file_type.value} file not supported for now.")
@@ -102,7 +185,7 @@ def complete_remove_file(
         file_id=file_id)
 
     # Delete original file
-    if new_path.is_file() and path != new_path: path.unlink()
+    if isfile(new_path) and path != new_path: remove(path)
 
     # Return call result
     return result
@@ -115,9 +198,14 @@ def watch_pool_files(
         model: str = Chat.MODELS[0],
         timeout: int | None = None, retries: int | None = 0,
         max_chats: int | None = None, max_files: int | None = None,
-        status_delay: int = 1 * 60, refresh_delay: int = 1):
+        status_delay: int | None = 1 * 60, refresh_delay: int = 1,
+        executor_class: type[Executor] = ThreadPoolExecutor):
     """Watch directory and pool files for autocomplete
 
+    Files are completed concurrently in threads (default), or in processes with
+    executor_class ProcessPoolExecutor to parse files in parallel (note that
+    rate limits set with wraipi.set_rate_limits are then per process).
+
     Params:
         root_dir: Path to pool root directory (ok if new dir.)
         in_dir_name: Name of input directory within root_dir
@@ -128,24 +216,34 @@ def watch_pool_files(
         retries: See complete_remove_file param.
         max_chats: See complete_remove_file param.
         max_files: Max. concurrent file completions (None for default)
-        status_delay: Delay in seconds before printing status
-        refresh_delay: Delay in seconds before checking for files in input dir.
+        status_delay: Delay in seconds before printing status (None for no status)
+        refresh_delay: Max. delay in seconds before checking for files in input dir.
+        executor_class: Executor class for file completions
     """
 
     start = datetime.now()
     logger = module_logger.getChild(watch_pool_files.__name__)
 
-    def valid_file(path: Path, dir_name: str):
-        """Test for valid file for completion"""
+    def valid_file(entry: DirEntry, dir_name: str):
+        """Test for valid file for completion (without extra stat call)"""
         try:
-            validate(FileType.from_path(path))
+            if not entry.is_file():
+                raise FileNotFoundError(f"Invalid path: '{entry.path}' is not a file.'")
+            validate(FileType.from_extension(splitext(entry.name)[1]))
             return True
         except Exception:
             logger.warning(
                 f"Invalid file or file type, "
-                f"please remove '{path.name}' from {dir_name} directory.")
+                f"please remove '{entry.name}' from {dir_name} directory.")
             return False
 
+    def dir_entries(path: Path) -> list[DirEntry]:
+        """List directory entries (without dot files if ignored)"""
+        with scandir(path) as entries:
+            return [
+                e for e in entries
+                if not (IGNORE_DOT_FILE and e.name.startswith('.'))]
+
     # Start messages
     logger.info("Watch and pool files for chat completion.")
     logger.info(f"Start time: {start.strftime('%c')}")
@@ -153,140 +251,143 @@ def watch_pool_files(
     # Directories initialization
     logger.info(f"Root directory: {root_dir}")
     if not isinstance(root_dir, Path): root_dir = Path(root_dir)
-    root_dir.mkdir(exist_ok=True)
+    ensure_dir(root_dir)
 
     logger.info(f"Input directory (drop file here): {in_dir_name}")
     in_dir = root_dir / in_dir_name
-    in_dir.mkdir(exist_ok=True)
+    ensure_dir(in_dir)
 
     logger.info(f"Output directory (get file here): {out_dir_name}")
     out_dir = root_dir / out_dir_name
-    out_dir.mkdir(exist_ok=True)
+    ensure_dir(out_dir)
 
     logger.info(f"Cache directory: {CACHE_DIR_NAME}")
     cache_dir = root_dir / CACHE_DIR_NAME
-    cache_dir.mkdir(exist_ok=True)
+    ensure_dir(cache_dir)
 
     # Check cache content
-    cache_entries = tuple(e for e in listdir(cache_dir))
-    if IGNORE_DOT_FILE:
-        cache_entries = tuple(
-            e for e in cache_entries if not e.startswith('.'))
-    pool_filenames = []
+    cache_entries = dir_entries(cache_dir)
+    pool_files = []  # Original and new filenames, cache and output paths
     if len(cache_entries) > 0:
         logger.warning(
-            f"Warning: cache is not empty,"
+            f"Warning: cache is not empty, "
             f"these entries are safe to delete if they are not reloaded automatically: "
-            f', '.join((repr(e) for e in cache_entries)))
+            + ', '.join((repr(e.name) for e in cache_entries)))
         if RELOAD_CACHE:
             logger.info("Add old files to the list of pool files.")
-            for entry_name in cache_entries:
-                if valid_file(cache_dir/entry_name, 'cache'):
-                    pool_filenames.append((entry_name, entry_name))
-
-    # Idle delay
-    status_delay = timedelta(seconds=round(status_delay))
+            for entry in cache_entries:
+                if valid_file(entry, 'cache'):
+                    pool_files.append((
+                        entry.name, entry.name,
+                        cache_dir / entry.name, out_dir / entry.name))
 
     # Keep exceptions returned by file completion
     exceptions = []
 
     def write_status(f=None, e=None):
         """Print status"""
-        nonlocal last_status_time
-        status = f"Status: "
-        if f is not None: status += f"{f} new file(s), "
-        if e is not None: status += f"{e} new error(s), "
-        q = len(future_names)
-        status += \
-            f"{q} file(s) in queue, " \
-            f"completed {file_id_counter - q} file(s) with {total_errors} error(s) " \
-            f"({datetime.now().strftime('%X')})"
-        last_status_time = datetime.now()
-        return status
+        nonlocal status_deadline
+        parts = ["Status: "]
+        if f is not None: parts.append(f"{f} new file(s), ")
+        if e is not None: parts.append(f"{e} new error(s), ")
+        q = pending_files
+        parts.append(
+            f"{q} file(s) in queue, "
+            f"completed {file_id_counter + 1 - q} file(s) with {total_errors} error(s) "
+            f"({datetime.now().strftime('%X')})")
+        if status_delay is not None: status_deadline = monotonic() + status_delay
+        return ''.join(parts)
 
     # Context manager for the thread pool executor
-    with ThreadPoolExecutor(max_workers=max_files) as executor:
+    # (executor shuts down before watcher closes, for done callbacks)
+    with (DirectoryWatcher(in_dir) as watcher,
+          executor_class(max_workers=max_files) as executor):
 
         file_id_counter = -1
         total_errors = 0
-        future_names = {}
-        last_status_time = datetime.now()
+        pending_files = 0
+        done_futures = SimpleQueue()  # Futures and names put by done callback
+
+        def put_done(future, name):
+            done_futures.put((future, name))
+            watcher.wake()
+        status_deadline = None if status_delay is None else monotonic() + status_delay
         invalid_entry_names = set()
+        scan = True  # Scan input directory (first loop or if changed)
 
         # Main watch and pool loop
         while True:
 
             # Print idle status
-            if status_delay is not None and now_delta(last_status_time) > status_delay:
+            if status_deadline is not None and monotonic() >= status_deadline:
                 logger.info(write_status())
                 # print_f("I am bored, please feed me...")
 
-            # Cache new file(s)(if any)
-            prev_invalid_entry_names = set(invalid_entry_names)
-            invalid_entry_names.clear()
-            for entry_name in listdir(in_dir):
-
-                entry_path = in_dir / entry_name
-
-                if IGNORE_DOT_FILE and entry_name.startswith('.'): continue
-                if entry_name in prev_invalid_entry_names:
-                    invalid_entry_names.add(entry_name)
-                    continue
-                if not valid_file(entry_path, 'input'):
-                    invalid_entry_names.add(entry_name)
-                    continue
-
-                new_filename = write_new_filename(
-                    datetime.now().strftime('%Y-%m-%d %H%M%S') + ' ' + entry_name,
-                    cache_dir, out_dir)
-                entry_path.rename(cache_dir / new_filename)
-                pool_filenames.append((entry_name, new_filename))
+            # Cache new file(s)(if any, only if input directory changed)
+            if scan:
+                entries = dir_entries(in_dir)
+                invalid_entry_names.intersection_update(e.name for e in entries)
+                for entry in entries:
+
+                    if entry.name in invalid_entry_names: continue
+                    if not valid_file(entry, 'input'):
+                        invalid_entry_names.add(entry.name)
+                        continue
+
+                    new_filename = write_new_filename(
+                        datetime.now().strftime('%Y-%m-%d %H%M%S') + ' ' + entry.name,
+                        cache_dir, out_dir)
+                    cache_path = cache_dir / new_filename
+                    rename(entry.path, cache_path)
+                    pool_files.append((
+                        entry.name, new_filename, cache_path, out_dir / new_filename))
 
             # Pool new file(s)(if any)
             new_files_count = 0
-            for filename in pool_filenames:
+            for filename, new_filename, cache_path, out_path in pool_files:
                 file_id_counter += 1
                 file_id = f"file {file_id_counter}"
                 new_files_count += 1
-                new_name = f"file '{filename[1]}'{rmark(file_id)}"
-                logger.info(f"Pooling file '{filename[0]}' as {new_name}")
+                new_name = f"file '{new_filename}'{rmark(file_id)}"
+                logger.info(f"Pooling file '{filename}' as {new_name}")
                 future = executor.submit(
                     complete_remove_file,
-                    path=cache_dir / filename[1], new_path=out_dir / filename[1],
+                    path=cache_path, new_path=out_path,
                     file_id=file_id,
                     api_keys=api_keys,
                     model=model, timeout=timeout, retries=retries,
                     max_chats=max_chats)
-                future_names[future] = new_name
-            pool_filenames.clear()
-
-            # Log debug status if new files
-            if new_files_count > 0:
-                logger.debug(write_status(f=new_files_count))
+                pending_files += 1
+                future.add_done_callback(
+                    lambda f, name=new_name: put_done(f, name))
+            pool_files.clear()
 
             # Manage threads' result and exceptions
-            done_futures = (
-                future for future in tuple(future_names) if future.done())
             new_errors_count = 0
-            for future in done_futures:
-                name = future_names[future]
-                future_names.pop(future)
-                if future.exception() is not None:
-                    logger.critical(
-                        write_error(
-                            future.exception(), name, re_raise=True, sep='\n'))
-                    raise future.exception()
-                elif future.result() is not None:
-                    exceptions.append(future.result())
-                    new_errors_count += len(future.result())
+            while True:
+                try: future, name = done_futures.get_nowait()
+                except Empty: break
+                pending_files -= 1
+                try: result = future.result()
+                except Exception as e:
+                    logger.critical(write_error(e, name, re_raise=True, sep='\n'))
+                    raise e
+                if result is not None:
+                    exceptions.append(result)
+                    new_errors_count += len(result)
             total_errors += new_errors_count
 
-            # Log debug status if new error(s)
-            if new_errors_count > 0:
-                logger.debug(write_status(e=new_errors_count))
-
-            # Sleep
-            sleep(refresh_delay)
+            # Log debug status (once) if new file(s) or error(s)
+            if new_files_count > 0 or new_errors_count > 0:
+                logger.debug(write_status(
+                    f=new_files_count or None, e=new_errors_count or None))
+
+            # Wait for new file(s) in input directory, completed file(s) or status
+            # (input directory scanned again unless only woken up)
+            timeout = refresh_delay
+            if status_deadline is not None:
+                timeout = max(0, min(timeout, status_deadline - monotonic()))
+            scan = watcher.wait(timeout)
 
 
 
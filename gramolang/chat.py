@@ -10,14 +10,18 @@ Completion: NamedTuple with choice, request and response instances
 
 """
 
-from typing import Any, NamedTuple
+from typing import Any, NamedTuple, Sequence, Iterator
 from logging import getLogger
 from pathlib import Path
+from json import JSONDecoder
+from asyncio import Semaphore, gather
+from contextlib import nullcontext
 
 from .common import (
     TEMPERATURE_NAMES, TOP_P_NAMES, NONE_ARG,
     Role, Message)
-from .wraipi import APIWrapper, MODEL_TO_APIWRAPPER
+from .wraipi import (
+    APIWrapper, MODEL_TO_APIWRAPPER, rate_limits)
 from .command import (
     Command, EmptyCommand, UnaryCommand, UnaryRequiredCommand,
     Commands)
@@ -36,11 +40,45 @@ class Completion(NamedTuple):
     response: Any
 
 
+# Helper functionalities
+# ----------------------
+
+def convert_value(
+        value, to_type: type,
+        minimum: int | float | None = None, maximum: int | float | None = None):
+    """Convert value to type (if not already) and check it is within range"""
+    if type(value) is not to_type: value = to_type(value)
+    if minimum is not None and value < minimum:
+        raise ValueError(f"Invalid value {value}, must be >= {minimum}")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"Invalid value {value}, must be <= {maximum}")
+    return value
+
+
+def parse_json_strings(content: str | None, length: int) -> list[str]:
+    """Return first JSON array of length strings in content (text around ignored)"""
+    decoder = JSONDecoder()
+    content = '' if content is None else content
+    start = content.find('[')
+    while start != -1:
+        try: value, _ = decoder.raw_decode(content, start)
+        except ValueError: value = None
+        if (
+                isinstance(value, list) and len(value) == length and
+                all(isinstance(v, str) for v in value)):
+            return value
+        start = content.find('[', start + 1)
+    raise ValueError(
+        f"Invalid batch response, expected a JSON array of {length} strings: "
+        f"{content!r}")
+
+
 # Commands
 # --------
 
 class UserCommand(UnaryRequiredCommand):
     """Append user message (i.e. message with user role)."""
+    __slots__ = ()
     NAMES = ('user', )
 
     def __init__(self, arg: str, name=NAMES[0]) -> None:
@@ -49,6 +87,7 @@ class UserCommand(UnaryRequiredCommand):
 
 class SystemCommand(UnaryCommand):
     """Append system message (i.e. message with system role)."""
+    __slots__ = ()
     NAMES = ('system', 'sys', 'system_role', 'sys_role')
 
     def __init__(self, arg: str | None = None, name=NAMES[0]) -> None:
@@ -58,79 +97,123 @@ class SystemCommand(UnaryCommand):
 
 class CompleteCommand(Command):
     """Complete chat/conversation and append response as assistant message."""
+    __slots__ = ()
     NAMES = ('assistant', 'complete')
 
     def __init__(self, *args, name=NAMES[0], **kwargs) -> None:
         super().__init__(*args, name=name, **kwargs)
 
 
+class AsyncCompleteCommand(Command):
+    """Complete chat/conversation asynchronously and append response."""
+    __slots__ = ()
+    NAMES = ('acomplete', 'async_complete')
+
+    def __init__(self, *args, name=NAMES[0], **kwargs) -> None:
+        super().__init__(*args, name=name, **kwargs)
+
+
+class BatchCommand(UnaryRequiredCommand):
+    """Complete each line as an item of one batch request (file in console)."""
+    __slots__ = ()
+    NAMES = ('batch',)
+
+    def __init__(self, arg: str, name=NAMES[0]) -> None:
+        super().__init__(str(arg), name=name)
+
+
 class MaxTokensCommand(UnaryCommand):
     """Set/get maximum number of tokens to generate for chat completion."""
+    __slots__ = ()
     NAMES = ('max_tokens', 'max_token')
 
     def __init__(
             self, arg: int | None | type(NONE_ARG) = NONE_ARG,
             name=NAMES[0]) -> None:
-        if not (arg is None or arg is NONE_ARG): arg = int(arg)
+        if not (arg is None or arg is NONE_ARG):
+            arg = convert_value(arg, int, 1)
         super().__init__(arg, name=name)
 
 
 class TemperatureCommand(UnaryCommand):
     """Set/get sampling temperature for chat completion."""
+    __slots__ = ()
     NAMES = TEMPERATURE_NAMES
 
     def __init__(
             self, arg: float | None | type(NONE_ARG) = NONE_ARG,
             name=NAMES[0]) -> None:
-        if not (arg is None or arg is NONE_ARG): arg = float(arg)
+        if not (arg is None or arg is NONE_ARG):
+            arg = convert_value(arg, float, 0, 2)
         super().__init__(arg, name=name)
 
 
 class TopPCommand(UnaryCommand):
     """Set/get top probability mass of tokens to consider."""
+    __slots__ = ()
     NAMES = TOP_P_NAMES
 
     def __init__(
             self, arg: float | None | type(NONE_ARG) = NONE_ARG,
             name=NAMES[0]) -> None:
-        if not (arg is None or arg is NONE_ARG): arg = float(arg)
+        if not (arg is None or arg is NONE_ARG):
+            arg = convert_value(arg, float, 0, 1)
         super().__init__(arg, name=name)
 
 
 class ChoicesCommand(UnaryCommand):
-    """Set/get top probability mass of tokens to consider."""
+    """Set/get number of choices to generate in one chat completion."""
+    __slots__ = ()
     NAMES = ('choices',)
 
     def __init__(
             self, arg: int | None | type(NONE_ARG) = NONE_ARG,
             name=NAMES[0]) -> None:
-        if not (arg is None or arg is NONE_ARG): arg = int(arg)
+        if not (arg is None or arg is NONE_ARG):
+            arg = convert_value(arg, int, 1)
         super().__init__(arg, name=name)
 
 
 class TimeoutCommand(UnaryCommand):
     """Set/get time in seconds before chat completion times out."""
+    __slots__ = ()
     NAMES = ('timeout',)
 
     def __init__(
             self, arg: int | None | type(NONE_ARG) = NONE_ARG,
             name=NAMES[0]) -> None:
-        if not (arg is None or arg is NONE_ARG): arg = round(float(arg))
+        if not (arg is None or arg is NONE_ARG):
+            arg = round(convert_value(arg, float, 0))
         super().__init__(arg, name=name)
 
 
 class RetriesCommand(UnaryCommand):
     """Set/get additional retries attempts on error."""
+    __slots__ = ()
     NAMES = ('retries',)
 
     def __init__(
             self, arg: int | type(NONE_ARG) = NONE_ARG, name=NAMES[0]) -> None:
-        if arg is not NONE_ARG: super().__init__(int(arg), name=name)
+        if arg is not NONE_ARG: super().__init__(convert_value(arg, int, -1), name=name)
         else: super().__init__(name=name)
 
 
+class WindowCommand(UnaryCommand):
+    """Set/get window size w (leading system and last w to 2w messages sent)."""
+    __slots__ = ()
+    NAMES = ('window',)
+
+    def __init__(
+            self, arg: int | None | type(NONE_ARG) = NONE_ARG,
+            name=NAMES[0]) -> None:
+        if not (arg is None or arg is NONE_ARG):
+            arg = convert_value(arg, int, 1)
+        super().__init__(arg, name=name)
+
+
 class ClearCommand(EmptyCommand):
     """Clear messages history."""
+    __slots__ = ()
     NAMES = ('clear',)
 
     def __init__(self, *, name=NAMES[0]) -> None:
@@ -139,6 +222,7 @@ class ClearCommand(EmptyCommand):
 
 class ResetCommand(EmptyCommand):
     """Reset all agent parameters and clear messages history."""
+    __slots__ = ()
     NAMES = ('reset',)
 
     def __init__(self, *, name=NAMES[0]) -> None:
@@ -147,12 +231,14 @@ class ResetCommand(EmptyCommand):
 
 class ModelCommand(UnaryCommand):
     """Set/get model for chat completion."""
+    __slots__ = ()
     NAMES = ('model',)
 
     def __init__(
             self, arg: str | None | type(NONE_ARG) = NONE_ARG,
             name=NAMES[0]) -> None:
-        if not (arg is None or arg is NONE_ARG): arg = str(arg)
+        if not (arg is None or arg is NONE_ARG):
+            arg = str(arg)
         super().__init__(arg, name=name)
 
 
@@ -168,6 +254,11 @@ class Chat:
     # Default system message
     SYSTEM_MESSAGE = "You’re a kind helpful assistant"  # Default System Role
 
+    # Prompt for batch completion (followed by one line for each item)
+    BATCH_PROMPT = (
+        "Respond to each input separately. Return only a JSON array of "
+        "strings with one response for each input, in the same order. Inputs:")
+
     # Default values for reset attributes
     MAX_TOKENS: int | None = None       # 1, 2, 3, ..., ? (tokens) | None
     TEMPERATURE: float | None = None    # 0 <= Value <= 2 | None
@@ -175,10 +266,22 @@ class Chat:
     CHOICES: int | None = None          # 1, 2, 3, ... | None
     TIMEOUT: int | None = None          # 0, 1, 2, ... (seconds) | None
     RETRIES: int = 0                    # -1 (infinite retries), 0, 1, 2, ...
+    WINDOW: int | None = None           # 1, 2, 3, ... (see window_messages) | None
+
+    # Reset attributes names (default value in upper case class attribute)
+    _RESET_ATTRIBUTES = (
+        'max_tokens', 'temperature', 'top_p', 'choices',
+        'timeout', 'retries', 'window')
+
+    __slots__ = (
+        'logger', '_api_keys', '_api_wrappers', '_api_wrapper', '_model',
+        *_RESET_ATTRIBUTES,
+        'messages', 'completions', '_role_indexes')
 
     def __init__(
             self,
-            api_keys: dict[type(APIWrapper): str] | None = None
+            api_keys: dict[type(APIWrapper): str] | None = None,
+            api_wrappers: dict[type(APIWrapper): APIWrapper] | None = None
             ) -> None:
 
         # Logging
@@ -188,30 +291,31 @@ class Chat:
         # APIs Keys and Wrappers
         self._api_keys: dict[type(APIWrapper): str] = (
             {} if api_keys is None else api_keys)
-        self._api_wrappers: dict[type(APIWrapper): APIWrapper] = {}
+        self._api_wrappers: dict[type(APIWrapper): APIWrapper] = (
+            {} if api_wrappers is None else dict(api_wrappers))
 
         # Current APIWrapper and Model
         self._api_wrapper: APIWrapper | None = None
         self._model: str | None = None
 
-        # Reset attributes
-        # ----------------
-
-        self.max_tokens: int | None = self.MAX_TOKENS
-        self.temperature: float | None = self.TEMPERATURE
-        self.top_p: float | None = self.TOP_P
-        self.choices: int | None = self.CHOICES
-
-        # Timeout and retries
-        self.timeout: int | None = self.TIMEOUT
-        self.retries: int = self.RETRIES
+        # Reset attributes (see class default values)
+        self.max_tokens: int | None
+        self.temperature: float | None
+        self.top_p: float | None
+        self.choices: int | None
+        self.timeout: int | None
+        self.retries: int
+        self.window: int | None
+        self._reset_attributes()
 
         # Messages and completions
         self.messages: list[Message] = []
         self.completions: list[Completion] = []
-        self.last_system_message_index: int | None = None
-        self.last_user_message_index: int | None = None
-        self.last_assistant_message_index: int | None = None
+        self._role_indexes: dict[Role: list[int]] = {role: [] for role in Role}
+
+    def _reset_attributes(self) -> None:
+        for name in self._RESET_ATTRIBUTES:
+            setattr(self, name, getattr(self, name.upper()))
 
     def clear(self, default_system_message: bool = False) -> None:
         """Clear messages history."""
@@ -220,29 +324,14 @@ class Chat:
 
         self.messages.clear()
         self.completions.clear()
-        self.last_system_message_index: int | None = None
-        self.last_user_message_index: int | None = None
-        self.last_assistant_message_index: int | None = None
+        for indexes in self._role_indexes.values(): indexes.clear()
         if default_system_message: self.append_system_message()
 
     def reset(self, default_system_message: bool = False) -> None:
         """Reset all agent parameters and clear messages history."""
 
         self.logger.debug(f"Reset {self}")
-
-        self.max_tokens: int | None = self.MAX_TOKENS
-        self.temperature: float | None = self.TEMPERATURE
-        self.top_p: float | None = self.TOP_P
-        self.choices: int | None = self.CHOICES
-
-        # Timeout
-        self.timeout: int | None = self.TIMEOUT
-        self.retries: int = self.RETRIES
-
-        # Messages and completions
-        self.last_system_message_index: int | None = None
-        self.last_user_message_index: int | None = None
-        self.last_assistant_message_index: int | None = None
+        self._reset_attributes()
 
         # Clear to complete reset
         self.clear(default_system_message=default_system_message)
@@ -260,44 +349,61 @@ class Chat:
         # Instantiate/set API wrapper and model
         api_wrapper_class = MODEL_TO_APIWRAPPER[value]
         if api_wrapper_class not in self._api_wrappers:
-            self._api_wrapper = api_wrapper_class(
+            self._api_wrappers[api_wrapper_class] = api_wrapper_class(
                 api_key=self._api_keys.get(api_wrapper_class, None))
-            self._api_wrappers[api_wrapper_class] = self._api_wrapper
+        self._api_wrapper = self._api_wrappers[api_wrapper_class]
         self._model = value
         return self._model
 
+    def _last_role_index(self, role: Role) -> int | None:
+        indexes = self._role_indexes[role]
+        return indexes[-1] if indexes else None
+
+    @property
+    def last_system_message_index(self) -> int | None:
+        return self._last_role_index(Role.SYSTEM)
+
+    @property
+    def last_user_message_index(self) -> int | None:
+        return self._last_role_index(Role.USER)
+
+    @property
+    def last_assistant_message_index(self) -> int | None:
+        return self._last_role_index(Role.ASSISTANT)
+
+    def _append_message(self, role: Role, content: str) -> None:
+        self._role_indexes[role].append(len(self.messages))
+        self.messages.append(Message(role, content))
+
     def append_system_message(self, content: str = SYSTEM_MESSAGE) -> None:
         """Append message with system role to messages list."""
-        self.messages.append(Message(Role.SYSTEM, content))
-        self.last_system_message_index = len(self.messages) - 1
+        self._append_message(Role.SYSTEM, content)
 
     def append_user_message(self, content: str) -> None:
         """Append message with user role to messages list."""
-        self.messages.append(Message(Role.USER, content))
-        self.last_user_message_index = len(self.messages) - 1
+        self._append_message(Role.USER, content)
 
     def append_assistant_message(self, content: str) -> None:
         """Append message with assistant role to messages list."""
-        self.messages.append(Message(Role.ASSISTANT, content))
-        self.last_assistant_message_index = len(self.messages) - 1
+        self._append_message(Role.ASSISTANT, content)
 
     def append_completion(self, request: dict, response) -> None:
         """Append assistant message from completion response."""
-        for i, choice in enumerate(response.choices):
-            self.completions.append(Completion(i, request, response))
-            self.append_assistant_message(choice.message.content)
+        choices = response.choices
+        start = len(self.messages)
+        self.completions.extend(
+            Completion(i, request, response) for i in range(len(choices)))
+        self.messages.extend(
+            Message(Role.ASSISTANT, c.message.content) for c in choices)
+        self._role_indexes[Role.ASSISTANT].extend(range(start, len(self.messages)))
 
     def role_messages(self, role: Role) -> tuple[Message]:
         """Return tuple of messages for role"""
-        return tuple(
-            Message(m.role, m.content)
-            for m in self.messages if m.role == role)
+        return tuple(self.messages[i] for i in self._role_indexes[role])
 
     def messages_counts(self):
-        """"Calculate and return dictionary with counts for each message type"""
-        counts = {role: 0 for role in Role}
-        for m in self.messages: counts[m.role] += 1
-        return counts
+        """"Return dictionary with counts for each message type"""
+        return {role: len(indexes) for role, indexes in self._role_indexes.items()}
 
     # DEPRECATED
     # def last_user_message(self) -> str | None:
@@ -323,70 +429,35 @@ class Chat:
         if len(self.completions) > 0: return self.completions[-1]
         else: return None
 
-    # DEPRECATED
-    # @staticmethod
-    # def validate_temperature(value) -> float | None:
-    #     if value is None: return None
-    #     else:
-    #         try:
-    #             test = float(value)
-    #             if 0 < test > 2: raise ValueError
-    #         except ValueError:
-    #             raise ValueError(
-    #                 f"Invalid value {value}, temperature must be between 0 and 2")
-    #         return test
-
-    # DEPRECATED
-    # @staticmethod
-    # def validate_top_p(value) -> float | None:
-    #     if value is None: return None
-    #     else:
-    #         try:
-    #             test = float(value)
-    #             if 0 < test > 1: raise ValueError
-    #         except ValueError:
-    #             raise ValueError(
-    #                 f"Invalid value {value}, top probability (top_p) must be between 0 and 1")
-    #         return test
-
-    # DEPRECATED
-    # @staticmethod
-    # def validate_n(value) -> int | None:
-    #     if value is None: return None
-    #     else:
-    #         try:
-    #             test = int(value)
-    #             if 0 < test > 255: raise ValueError
-    #         except ValueError:
-    #             raise ValueError(
-    #                 f"Invalid value {value}, number of choices (n) must be between 0 and 255")
-    #         return test
-
-    # DEPRECATED
-    # @staticmethod
-    # def validate_timeout(value) -> int | None:
-    #     if value is None: return None
-    #     else:
-    #         try:
-    #             test = int(value)
-    #             if not test > 0: raise ValueError
-    #         except Exception:
-    #             raise ValueError(
-    #                 f"Invalid value {value}, timeout seconds must convert to an int > 0")
-    #         return test
-
-    # DEPRECATED
-    # @staticmethod
-    # def validate_retries(value: int) -> int:
-    #     if value is None: return None
-    #     else:
-    #         try:
-    #             test = int(value)
-    #             if not test >= 0: raise ValueError
-    #         except Exception:
-    #             raise ValueError(
-    #                 f"Invalid value {value}, retries must convert to an int >= 0")
-    #         return test
+    def last_choices(self) -> tuple[str]:
+        """Return contents of all choices from last completion response."""
+        if len(self.completions) == 0: return ()
+        return tuple(
+            c.message.content for c in self.completions[-1].response.choices)
+
+    def window_messages(self) -> list[Message]:
+        """Return messages in window for chat completion.
+
+        Leading system messages are always sent, and the window applies to the
+        messages after them. The window start moves forward in steps of window
+        size (when more than twice the window size messages are in the window),
+        so the prefix of messages sent is stable between steps (for API prompt
+        caching). The start is computed from the number of messages, so it
+        follows changes of window or messages.
+        """
+        if self.window is None: return self.messages
+
+        # Number of leading system messages
+        system_count = 0
+        for i in self._role_indexes[Role.SYSTEM]:
+            if i != system_count: break
+            system_count += 1
+
+        # Window start in steps of window size
+        overflow = len(self.messages) - system_count - 2 * self.window
+        if overflow <= 0: return self.messages
+        start = system_count + -(-overflow // self.window) * self.window
+        return self.messages[:system_count] + self.messages[start:]
 
     def complete(
             self, append_completion: bool = True,
@@ -397,7 +468,80 @@ class Chat:
 
         # Call API wrapper complete chat method
         request, response = self._api_wrapper.complete_chat(
-            model=self._model, messages=self.messages,
+            model=self._model, messages=self.window_messages(),
+            max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p,
+            choices=self.choices,
+            timeout=self.timeout, retries=self.retries,
+            call_id=call_id)
+
+        # Add assistant response
+        if append_completion: self.append_completion(request, response)
+
+        # Return response
+        return request, response
+
+    def complete_stream(
+            self, append_completion: bool = True,
+            call_id: str | int | None = None) -> Iterator[str]:
+        """Chat completion streamed, yield parts of content as they arrive
+
+        Choices are ignored (one choice streamed), and the complete content is
+        appended as an assistant message at the end of the stream.
+        """
+
+        self.logger.debug(f"Complete {self} with stream")
+
+        parts = []
+        for part in self._api_wrapper.stream_chat(
+                model=self._model, messages=self.window_messages(),
+                max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p,
+                timeout=self.timeout, retries=self.retries,
+                call_id=call_id):
+            parts.append(part)
+            yield part
+
+        # Add assistant message
+        if append_completion: self.append_assistant_message(''.join(parts))
+
+    def batch_complete(
+            self, items: Sequence[str], call_id: str | int | None = None
+            ) -> list[str]:
+        """Complete items in one request and return one response for each
+
+        Items are sent together in a single user message after the chat
+        messages, and the chat is not modified. Choices are not requested (one
+        response for each item).
+        """
+
+        self.logger.debug(f"Batch complete {len(items)} items with {self}")
+
+        content = '\n'.join(
+            (self.BATCH_PROMPT,) + tuple(f"[{i}] {x}" for i, x in enumerate(items)))
+        request, response = self._api_wrapper.complete_chat(
+            model=self._model,
+            messages=self.window_messages() + [Message(Role.USER, content)],
+            max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p,
+            timeout=self.timeout, retries=self.retries,
+            call_id=call_id)
+
+        # Response for each item
+        return parse_json_strings(response.choices[0].message.content, len(items))
+
+    def batch_complete_lines(self, text: str) -> list[str]:
+        """Complete each non-empty line of text in one batch request."""
+        return self.batch_complete(
+            tuple(line.strip() for line in text.splitlines() if line.strip()))
+
+    async def acomplete(
+            self, append_completion: bool = True,
+            call_id: str | int | None = None):
+        """Chat completion (asynchronous)"""
+
+        self.logger.debug(f"Complete {self} asynchronously")
+
+        # Await API wrapper asynchronous complete chat method
+        request, response = await self._api_wrapper.acomplete_chat(
+            model=self._model, messages=self.window_messages(),
             max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p,
             choices=self.choices,
             timeout=self.timeout, retries=self.retries,
@@ -411,15 +555,66 @@ class Chat:
 
     commands = Commands({
         UserCommand: append_user_message, SystemCommand: append_system_message,
-        CompleteCommand: complete,
+        CompleteCommand: complete, AsyncCompleteCommand: acomplete,
+        BatchCommand: batch_complete_lines,
         MaxTokensCommand: 'max_tokens', TemperatureCommand: 'temperature',
-        TopPCommand: 'top_p',
+        TopPCommand: 'top_p', ChoicesCommand: 'choices',
         TimeoutCommand: 'timeout', RetriesCommand: 'retries',
+        WindowCommand: 'window',
         ClearCommand: clear, ResetCommand: reset,
         ModelCommand: model})
 
     def execute(self, command: type | Command | str):
-        self.commands.instance_execute(self, command)
+        return self.commands.instance_execute(self, command)
 
     def parse_execute(self, string: str):
-        self.commands.parse_instance_execute(self, string)
+        return self.commands.parse_instance_execute(self, string)
+
+    async def aexecute(self, command: type | Command | str):
+        return await self.commands.ainstance_execute(self, command)
+
+    async def aparse_execute(self, string: str):
+        return await self.commands.aparse_instance_execute(self, string)
+
+
+# Concurrent completions
+# ----------------------
+
+async def complete_many(
+        chats: Sequence[Chat], max_concurrency: int | None = None,
+        requests_per_minute: int | None = None, tokens_per_minute: int | None = None,
+        append_completion: bool = True, return_exceptions: bool = False) -> list:
+    """Complete chats concurrently and return their requests and responses
+
+    Rate limits (if any given) replace the limits of the chats' models for the
+    completions of the call (see wraipi.rate_limits), and rate limit or timeout
+    errors are retried according to each chat's retries. Asynchronous clients
+    of the running loop are shared with other completions and left open: close
+    them when done (see wraipi.aclose_openai_clients).
+
+    Params:
+    chats: Chats to complete
+    max_concurrency: Max. number of completions in progress (None for no max.)
+    requests_per_minute: Requests per minute limit for the chats' models
+    tokens_per_minute: Tokens per minute limit for the chats' models
+    append_completion: Append completion to each chat
+    return_exceptions: Return exceptions instead of raising the first one
+    """
+
+    limits = nullcontext()
+    if requests_per_minute is not None or tokens_per_minute is not None:
+        limits = rate_limits(
+            {c.model() for c in chats}, requests_per_minute, tokens_per_minute)
+
+    semaphore = Semaphore(max_concurrency) if max_concurrency is not None else None
+
+    async def complete(chat: Chat, call_id: int):
+        if semaphore is None:
+            return await chat.acomplete(append_completion, call_id=call_id)
+        async with semaphore:
+            return await chat.acomplete(append_completion, call_id=call_id)
+
+    with limits:
+        return await gather(
+            *(complete(c, i) for i, c in enumerate(chats)),
+            return_exceptions=return_exceptions)
@@ -2,12 +2,14 @@
 Text command interface
 """
 
-from typing import Any, Sequence
-from logging import getLogger
-from inspect import isclass
+from typing import Any, Sequence, Callable
+from logging import getLogger, DEBUG
+from types import MappingProxyType
+from re import compile as re_compile
+from inspect import isawaitable, iscoroutine
 
 from .common import (
-    ESCAPE_CHAR, SPACE_SEP, NONE_ARG,
+    ESCAPE_CHAR, SPACE_SEP, NAME_VALUE_SEPS, NONE_ARG,
     parse_str_to_bool, parse_name_value)
 
 
@@ -15,7 +17,14 @@ from .common import (
 SYSTEM_COMMAND_NAMES = ('system', 'sys', 'system_role', 'sys_role')
 
 # String substitutions for None (lower case)
-NONE_STRINGS = (ESCAPE_CHAR, r'\none')
+NONE_STRINGS = frozenset((ESCAPE_CHAR, r'\none'))
+
+
+# Pattern for arguments (double-quoted with escaped quotes, or without spaces)
+ARGUMENTS_PATTERN = re_compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+# Separators between command name and arguments
+_ARGUMENTS_SEPS = NAME_VALUE_SEPS + (SPACE_SEP,)
 
 
 # Exceptions
@@ -34,6 +43,45 @@ def write_name_summary(names: Sequence[str], summary: str):
     return f"{', '.join(names)}: {summary}"
 
 
+def split_arguments(arguments: str) -> tuple[str]:
+    """Split arguments on whitespace, keeping double-quoted arguments whole"""
+    return tuple(
+        a.replace('\\"', '"') if a is not None else b
+        for a, b in (m.groups() for m in ARGUMENTS_PATTERN.finditer(arguments)))
+
+
+def doc_summary(doc: str | None) -> str | None:
+    """Return first line of a docstring (None if no docstring)"""
+    return doc.partition('\n')[0].strip() if doc is not None else None
+
+
+def parse_none(string: str) -> str | None:
+    """Return None if string is a substitution for None, else the string"""
+    # All None substitutions start with the escape char (avoid lowering others)
+    if string[:1] != ESCAPE_CHAR or string.lower() not in NONE_STRINGS: return string
+    return None
+
+
+def compile_executor(target) -> Callable[[Any, tuple, dict], Any]:
+    """Compile command target into function executing it on an instance
+
+    Target can be a function/method (called), a property (set with arguments
+    or get), or an attribute name (set with arguments or get).
+    """
+    if callable(target):
+        def execute(instance, args: tuple, kwargs: dict):
+            return target(instance, *args, **kwargs)
+    elif type(target) is property:
+        def execute(instance, args: tuple, kwargs: dict):
+            if args or kwargs: return target.fset(instance, *args, **kwargs)
+            else: return target.fget(instance)
+    else:
+        def execute(instance, args: tuple, kwargs: dict):
+            if args or kwargs: return setattr(instance, target, *args, **kwargs)
+            else: return getattr(instance, target)
+    return execute
+
+
 # Classes definitions
 # -------------------
 
@@ -41,12 +89,24 @@ def write_name_summary(names: Sequence[str], summary: str):
 class Command:
     """Inheritable-only class for all commands"""
 
+    __slots__ = ('_name', '_args', '_kwargs')
+
     NAMES = tuple()
 
+    # Summary from class docstring and lower case names (computed once for each class)
+    _summary: str | None = doc_summary(__doc__)
+    _LOWER_NAMES: frozenset[str] = frozenset()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._summary = doc_summary(cls.__doc__)
+        cls._LOWER_NAMES = frozenset(n.lower() for n in cls.NAMES)
+
     def __init__(self, *args, name: str | None = None, **kwargs) -> None:
-        if name is not None:
+        if name is not None and name not in self._LOWER_NAMES:
+            # Lower name only if not already a (lower case) class name
             name = name.lower()
-            if name not in self.NAMES:
+            if name not in self._LOWER_NAMES:
                 raise CommandClassError(f"Command name '{name}' not in class names")
         self._name: str | None = name
         self._args: tuple = args
@@ -62,36 +122,32 @@ class Command:
     def kwargs(self) -> dict: return self._kwargs
 
     @classmethod
-    def summary(cls) -> str:
-        return (
-            cls.__doc__.splitlines()[0].strip() if cls.__doc__ is not None
-            else None)
+    def summary(cls) -> str: return cls._summary
 
     @classmethod
     def parse_args(cls, *args: str, name: str | None = None, **kwargs):
         # TODO: Split/parse with shlex??
         # TODO: Split name=value pair and pass as kwarg
-        args = tuple(None if a.lower() in NONE_STRINGS else a for a in args)
-        kwargs = {k: None if v.lower() in NONE_STRINGS else v for k, v in kwargs.items()}
+        args = tuple(map(parse_none, args))
+        if kwargs: kwargs = {k: parse_none(v) for k, v in kwargs.items()}
         return cls(*args, name=name, **kwargs)
 
     @classmethod
     def parse(cls, arguments: str, name: str | None = None):
-        # TODO: Split/parse with shlex??
         # TODO: Ignore everything after comment char (#)?
-        arguments = arguments.strip()
-        arguments = tuple((a for a in arguments.split(sep=SPACE_SEP) if a))
-        return cls.parse_args(*arguments, name=name)
+        return cls.parse_args(*split_arguments(arguments), name=name)
 
 
 class EmptyCommand(Command):
     """Inheritable-only class for a command without parameters"""
+    __slots__ = ()
     def __init__(self, *, name: str | None = None) -> None:
         super().__init__(name=name)
 
 
 class UnaryCommand(Command):
     """Inheritable-only class for a command with one or no parameter"""
+    __slots__ = ()
     def __init__(self, arg=NONE_ARG, name: str | None = None) -> None:
         if arg is NONE_ARG: super().__init__(name=name)
         else: super().__init__(arg, name=name)
@@ -107,12 +163,19 @@ class UnaryCommand(Command):
 
 class UnaryRequiredCommand(Command):
     """Inheritable-only class for a command with one required argument"""
+    __slots__ = ()
     def __init__(self, arg, name: str | None = None) -> None:
         super().__init__(arg, name=name)
 
+    @classmethod
+    def parse(cls, arguments: str, name: str | None = None):
+        # Whole argument string as the argument (e.g. message or path)
+        return cls.parse_args(arguments.strip(), name=name)
+
 
 class ToggleCommand(UnaryCommand):
     """Inheritable-only class for a toggle command"""
+    __slots__ = ('set_value',)
     def __init__(
             self, set_value: bool | None = None, name: str | None = None
             ) -> None:
@@ -138,89 +201,137 @@ class ToggleCommand(UnaryCommand):
 
 
 class Commands:
-    """Collection of commands to provide an interface for another class"""
+    """Collection of commands to provide an interface for another class
+
+    The collection is immutable once created.
+    """
+
+    __slots__ = (
+        'logger', '_class_to_target', '_class_to_executor', '_dispatch',
+        '_class_to_summary')
 
     def __init__(
             self, cls_to_target: dict[type: Any], *args):
         self.logger = module_logger.getChild(self.__class__.__name__)
-        self._class_to_target: dict[type: Any] = {}
-        self._names_to_class: dict[str: type[Command]] = {}
+        class_to_target: dict[type: Any] = {}
+        class_to_executor: dict[type: Callable] = {}
+        dispatch: dict[type | str: type[Command]] = {}
+        class_to_summary: dict[type: str | None] = {}
         for d in (cls_to_target,) + args:
             for cls in d:
-                if cls in self._class_to_target:
+                if cls in class_to_target:
                     raise CommandError(
                         f"Command class {cls.__name__} already in collection")
-                self._class_to_target[cls] = d[cls]
-                for name in cls.NAMES:
-                    name = name.lower()
-                    if name in self._names_to_class:
+                class_to_target[cls] = d[cls]
+                dispatch[cls] = cls
+                class_to_executor[cls] = compile_executor(d[cls])
+                target_summary = doc_summary(getattr(d[cls], '__doc__', None))
+                class_to_summary[cls] = (
+                    target_summary if target_summary is not None
+                    else cls.summary())
+                for name in cls._LOWER_NAMES:
+                    if name in dispatch:
                         raise CommandError(
                             f"Name '{name}' for command class {cls.__name__} "
                             f"already in collection")
-                    self._names_to_class[name] = cls
+                    dispatch[name] = cls
+
+        # Frozen (read-only) mappings
+        self._class_to_target = MappingProxyType(class_to_target)
+        self._class_to_executor = MappingProxyType(class_to_executor)
+        # Dispatch table for both command classes and lower case names
+        self._dispatch = MappingProxyType(dispatch)
+        self._class_to_summary = MappingProxyType(class_to_summary)
 
     def __contains__(self, key) -> bool:
-        if isclass(key):
-            return key in self._class_to_target
-        if isinstance(key, Command):
-            return type(key) in self._class_to_target
-        return key.lower() in self._names_to_class
+        if key in self._dispatch: return True
+        if isinstance(key, str): return key.lower() in self._dispatch
+        return isinstance(key, Command) and type(key) in self._dispatch
 
     def __getitem__(self, key) -> type[Command]:
-        if isclass(key):
-            if key in self._class_to_target:
-                return key
-            else:
-                raise CommandClassError(
-                    f"No command class '{key.__name__}' in collection")
-        if isinstance(key, Command):
-            cls = type(key)
-            if cls in self._class_to_target:
-                return cls
-            elif cls is not Command:
-                raise CommandClassError(
-                    f"Command class '{cls.__name__}' of "
-                    f"instance '{key}' not in collection")
-        key = key.lower()
-        if key in self._names_to_class:
-            return self[self._names_to_class[key]]
-        else:
+        cls = self._dispatch.get(key)
+        if cls is not None: return cls
+        if isinstance(key, Command): return self._get_by_instance(key)
+        if isinstance(key, type): return self._get_by_class(key)
+        return self._get_by_name(key)
+
+    def _get_by_class(self, cls: type) -> type[Command]:
+        """Return command class if in collection"""
+        if cls in self._class_to_target: return cls
+        raise CommandClassError(f"No command class '{cls.__name__}' in collection")
+
+    def _get_by_instance(self, command: Command) -> type[Command]:
+        """Return class of command instance if in collection"""
+        cls = type(command)
+        if cls in self._class_to_target: return cls
+        raise CommandClassError(
+            f"Command class '{cls.__name__}' of instance '{command}' not in collection")
+
+    def _get_by_name(self, name: str) -> type[Command]:
+        """Return command class for name (classes are all in collection)"""
+        # Try name as is first (names are mostly already in lower case)
+        cls = self._dispatch.get(name)
+        if cls is None:
+            try: cls = self._dispatch.get(name.lower())
+            except AttributeError: cls = None
+        if cls is None:
             raise CommandClassError(
-                f"No command class with name '{key}' in collection")
+                f"No command class with name '{name}' in collection")
+        return cls
 
     def __iter__(self): return iter(self._class_to_target)
 
     def summary(self, key) -> str | None:
-        target_doc = self._class_to_target[self[key]].__doc__
-        if target_doc is not None: return target_doc.splitlines()[0].strip()
-        if self[key].summary() is not None: return self[key].summary()
-        else: return None
+        return self._class_to_summary[self[key]]
 
     def write_command_help(self, key) -> str:
-        return write_name_summary(self[key].NAMES, self.summary(key))
+        cls = self[key]
+        return write_name_summary(cls.NAMES, self._class_to_summary[cls])
 
     def parse(self, string: str) -> Command:
-        name, arguments = parse_name_value(string, single_name=True)
-        if arguments is None: return self[name](name=name)
-        else: return self[name].parse(arguments=arguments, name=name)
-
-    def instance_execute(self, instance, command: Command):
-        target = self._class_to_target[type(command)]
-        self.logger.debug(f"Execute {command} with target {target.__repr__()} on {instance}.")
-        if callable(target):
-            return target(instance, *command.args, **command.kwargs)
-        elif type(target) is property:
-            if len(command.args) > 0 or len(command.kwargs) > 0:
-                return target.fset(instance, *command.args, **command.kwargs)
-            else:
-                return target.fget(instance)
-        else:
-            if len(command.args) > 0 or len(command.kwargs) > 0:
-                return setattr(
-                    instance, target, *command.args, **command.kwargs)
-            else:
-                return getattr(instance, target)
+        # Fast path for bare command name (no separator, no arguments)
+        name = string.strip()
+        if not any(c in name for c in _ARGUMENTS_SEPS):
+            return self._get_by_name(name)(name=name)
+
+        name, arguments = parse_name_value(name, single_name=True)
+        cls = self._get_by_name(name)
+        if arguments is None: return cls(name=name)
+        else: return cls.parse(arguments=arguments, name=name)
+
+    def _execute(self, instance, command: Command | type | str) -> tuple[Command, Any]:
+        """Execute command and return the command (created if needed) and result"""
+        if not isinstance(command, Command):
+            command = (
+                self._get_by_class(command)() if isinstance(command, type)
+                else self.parse(command))
+        cls = type(command)
+        executor = self._class_to_executor.get(cls)
+        if executor is None: self._get_by_instance(command)  # Raise error
+        if self.logger.isEnabledFor(DEBUG):
+            target = self._class_to_target[cls]
+            self.logger.debug(f"Execute {command} with target {target.__repr__()} on {instance}.")
+        return command, executor(instance, command._args, command._kwargs)
+
+    def instance_execute(self, instance, command: Command | type | str):
+        command, result = self._execute(instance, command)
+        if iscoroutine(result):
+            result.close()
+            raise CommandError(
+                f"Command class {type(command).__name__} is asynchronous, "
+                f"execute it with ainstance_execute")
+        return result
 
     def parse_instance_execute(self, target_instance, string: str):
         return self.instance_execute(
             instance=target_instance, command=self.parse(string=string))
+
+    async def ainstance_execute(self, instance, command: Command | type | str):
+        """Execute command and await result if awaitable (e.g. coroutine method)"""
+        _, result = self._execute(instance, command)
+        if isawaitable(result): result = await result
+        return result
+
+    async def aparse_instance_execute(self, target_instance, string: str):
+        return await self.ainstance_execute(
+            instance=target_instance, command=self.parse(string=string))
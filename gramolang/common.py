@@ -2,17 +2,24 @@
 Common functionalities for multiple modules
 """
 
-from typing import Sequence, NamedTuple
-from logging import getLogger
+from typing import Any, Sequence, NamedTuple, Callable, Hashable
+from logging import getLogger, DEBUG
 from enum import Enum, StrEnum, unique
 from functools import wraps
+from inspect import iscoroutinefunction
+from types import MappingProxyType
+from re import compile as re_compile, escape as re_escape
 
 from pathlib import Path
-from os import listdir
+from os import listdir, scandir, stat, unlink
+from os.path import splitext, exists, join
 from shutil import rmtree
-from time import sleep
+from stat import S_ISDIR
+from time import sleep, monotonic
 from datetime import datetime, timedelta
-from random import random
+from random import uniform
+from threading import Lock, Event
+from asyncio import sleep as async_sleep
 
 from .version import VERSION
 
@@ -68,21 +75,14 @@ class Model(NamedTuple):
 @unique
 class FileType(str, Enum):
     def __new__(cls, value, extensions):
-        obj = str.__new__(cls, [value])
+        obj = str.__new__(cls, value)
         obj._value_ = value
         obj.extensions = extensions
-        if 'extensions' not in cls.__dict__: cls._extensions = {}
-        for ext in extensions: cls._extensions[ext] = obj
         return obj
 
-    # def __init__(self, value, extensions):
-    #     if 'extensions' not in self.__class__.__dict__:
-    #         self.__class__.extensions = {}
-    #     for ext in extensions: self.__class__.extensions[ext] = self
-
-    TEXT = ('Text', {'.txt', '.text'})
-    CSV = ('CSV', {'.csv'})
-    EXCEL = ('Excel', {'.xlsx', '.xls'})
+    TEXT = ('Text', frozenset(('.txt', '.text')))
+    CSV = ('CSV', frozenset(('.csv',)))
+    EXCEL = ('Excel', frozenset(('.xlsx', '.xls')))
 
     @classmethod
     def from_extension(cls, extension: str):
@@ -93,11 +93,15 @@ class FileType(str, Enum):
 
     @classmethod
     def from_path(cls, path: Path):
-        if not path.is_file():
-            raise FileNotFoundError(f"Invalid path: '{path}' is not a file.'")
+        """File type from path extension (opening the file checks it exists)"""
         return cls.from_extension(path.suffix)
 
 
+# Map of extensions to file types (built once all members exist)
+FileType._extensions = MappingProxyType(
+    {ext: file_type for file_type in FileType for ext in file_type.extensions})
+
+
 # DEPRECATED
 # FILETYPE_TO_EXTENSIONS: dict[FileType: tuple[str]] = {
 #     FileType.TEXT: ,
@@ -113,15 +117,20 @@ class FileType(str, Enum):
 # Very basic stuff
 # ----------------
 
+# Strings parsed as False (lower case)
+FALSE_STRINGS = frozenset(('0', 'false'))
+
+
 def parse_str_to_bool(string: str) -> bool:
-    if string.lower() in ('0', 'false'): return False
+    if string.lower() in FALSE_STRINGS: return False
     else: return bool(string)
 
 
 def join_none(
         value: int | str | None, *values: int | str | None,
         sep: str = ' ') -> str:
-    return sep.join(tuple(str(v) for v in (value, *values) if v is not None))
+    if not values: return '' if value is None else str(value)
+    return sep.join([v if type(v) is str else str(v) for v in (value, *values) if v is not None])
 
 
 # Text formatting
@@ -144,8 +153,8 @@ def rmark(
 
 def write_timedelta(d: timedelta | float | int, ndigits=None) -> str:
     """Write timedelta (duration) in a consistent format"""
-    if not isinstance(d, timedelta): d = timedelta(seconds=d)
-    return f"{round(d.total_seconds(), ndigits=ndigits)} s"
+    seconds = d.total_seconds() if isinstance(d, timedelta) else d
+    return f"{round(seconds, ndigits=ndigits)} s"
 
 
 def now_delta(start: datetime, total_seconds=False):
@@ -170,6 +179,8 @@ def write_error(
         exception: Exception | None = None, with_object: str | None = None,
         delta: timedelta = None, re_raise: bool = False, sep: str = ': '):
     """Write error message in a consistent format"""
+    if exception and not with_object and not re_raise:
+        return write_exception(exception, delta)
     parts = []
     if with_object:
         part = f"Error with {with_object}"
@@ -199,8 +210,9 @@ def print_error(
 
 # Parser/splitter for commands and text variables attributions
 # ------------------------------------------------------------
-def index_partition(string: str, i: int) -> tuple[str, str]:
-    return string[:i], string[i + 1:]
+
+# Pattern matching the first name/value separator
+NAME_VALUE_SEP_PATTERN = re_compile('|'.join(map(re_escape, NAME_VALUE_SEPS)))
 
 
 def parse_name_value(string, single_name=False) -> tuple[str | None, str | None]:
@@ -211,21 +223,15 @@ def parse_name_value(string, single_name=False) -> tuple[str | None, str | None]
     string = string.strip()
     if not string: return '', ''
 
-    sep = None
-    i = len(string)
-    for c in NAME_VALUE_SEPS:
-        new_i = string.find(c)
-        if new_i != -1 and new_i < i:
-            sep = c
-            i = new_i
-
-    if sep:
-        name, value = index_partition(string, i)
+    # Single name: separator after a space is part of the value (e.g. path)
+    match = NAME_VALUE_SEP_PATTERN.search(string)
+    if match and single_name and SPACE_SEP in string[:match.start()].rstrip():
+        match = None
+    if match:
+        name, _, value = string.partition(match.group())
     else:
-        i = string.find(SPACE_SEP)
-        if i != -1: name, value = index_partition(string, i)
-        elif single_name: name, value = string, ''
-        else: name, value = '', string
+        name, sep, value = string.partition(SPACE_SEP)
+        if not sep and not single_name: name, value = '', string
 
     name = name.rstrip() if name != '' else None
     value = value.lstrip() if value != '' else None
@@ -236,30 +242,39 @@ def parse_name_value(string, single_name=False) -> tuple[str | None, str | None]
 # File/directory functionalities
 # ------------------------------
 
-def write_new_filename(filename: str, *dirs: Path):
+def ensure_dir(path: Path) -> Path:
+    """Create directory (and parents) if it doesn't exist, with one stat if it does"""
+    try: mode = stat(path).st_mode
+    except FileNotFoundError:
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+    if not S_ISDIR(mode): raise NotADirectoryError(f"Not a directory: '{path}'")
+    return path
+
+
+def write_new_filename(filename: str, *dirs: Path | str) -> str:
     """Write a new filename that does not exist in a series of directories"""
-    i = 0
-    f = Path(filename)
-    check_filename = True
-    while check_filename:
-        check_filename = False
-        for d in dirs:
-            if d.joinpath(filename).exists():
-                i += 1
-                f = Path(f"{f.stem} [{i}]{f.suffix}")
-                check_filename = True
-    return f
+    if not any(exists(join(d, filename)) for d in dirs): return filename
+
+    # On collision, list directories once and find a new name in memory
+    names = set()
+    for d in dirs:
+        if exists(d): names.update(listdir(d))
+    stem, suffix = splitext(filename)
+    i = 1
+    while (filename := f"{stem} [{i}]{suffix}") in names: i += 1
+    return filename
 
 
 def remove_dir_entries(dir_path: Path):
     """Remove entries in a directory, re-raise exceptions"""
-    for path_name in listdir(dir_path):
-        path = dir_path / path_name
-        try:
-            if path.is_dir(): rmtree(path)
-            else: path.unlink()
-        except Exception as e:
-            raise e
+    with scandir(dir_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False): rmtree(entry.path)
+                else: unlink(entry.path)
+            except Exception as e:
+                raise e
 
 
 # Decorator for retry with exponential backoff
@@ -277,6 +292,9 @@ def retry(
 
     If retries equals 0 (default), the function will be called only once as if
     it had not been decorated. The total number of attempts equals retries + 1.
+    Without retries, the function is returned undecorated unless debug logging
+    is enabled.
+    Coroutine functions are decorated with an asynchronous wrapper.
 
     Params:
     call_id: Identification for function in log messages
@@ -293,42 +311,85 @@ def retry(
 
     logger = module_logger.getChild(retry.__name__)
 
+    # Function called once without logging: no need to decorate
+    if retries == 0 and not logger.isEnabledFor(DEBUG): return lambda func: func
+
+    spread = base_delay * spread_factor
+    min_delay, max_delay = base_delay - spread / 2, base_delay + spread / 2
+    retry_exceptions = tuple(rate_exceptions) + tuple(timeout_exceptions)
+    call_mark = mark(call_id)
+
+    def log(i: int, backoff_level: int, message: str, *messages: str):
+        """Log debug message (only written if debug is enabled)"""
+        if not logger.isEnabledFor(DEBUG): return
+        logger.debug(' '.join((
+            message,
+            f"{call_mark}[{i}/{retries}][LEV {backoff_level}]",
+            *log_messages, *messages)))
+
+    def retry_delay(e: Exception, i: int, backoff_level: int) -> tuple[float, int]:
+        """Re-raise exception if no retry left, or return delay and backoff level"""
+        if logger.isEnabledFor(DEBUG):
+            log(i, backoff_level, 'Rate or timeout error with function call',
+                write_exception(e))
+        if i == retries:
+            log(i, backoff_level, "Re-raising...")
+            raise e
+        delay = uniform(min_delay, max_delay) if jitter else base_delay
+        if isinstance(e, rate_exceptions):
+            backoff_level += 1
+            if backoff: delay *= backoff_base ** backoff_level
+        log(i, backoff_level, f"Sleep({round(delay, 1)}) and retry")
+        return delay, backoff_level
+
+    def log_unhandled(e: Exception, i: int, backoff_level: int):
+        if not logger.isEnabledFor(DEBUG): return
+        log(i, backoff_level, 'Error (unhandled) with function call',
+            write_error(exception=e, re_raise=True, sep='\n'))
+
     def decorate(func):
 
-        @wraps(func)
-        def wrapper(*args, **kwargs):
+        calling_message = f"Calling {func}"
+
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                backoff_level = 0
+                i = 0
+                while True:
+                    try:
+                        log(i, backoff_level, calling_message)
+                        result = await func(*args, **kwargs)
+                        log(i, backoff_level, 'Successfully completed call')
+                        break
+                    except retry_exceptions as e:
+                        delay, backoff_level = retry_delay(e, i, backoff_level)
+                        await async_sleep(delay)
+                    except Exception as e:
+                        log_unhandled(e, i, backoff_level)
+                        raise e
+                    i += 1
 
-            def write_log(message: str, *messages: str):
-                return ' '.join((
-                    message,
-                    f"{mark(call_id)}[{i}/{retries}][LEV {backoff_level}]",
-                    *log_messages, *messages))
+                return result
 
-            spread = base_delay * spread_factor
-            backoff_level = 0
+            return async_wrapper
 
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            backoff_level = 0
             i = 0
             while True:
                 try:
-                    logger.debug(write_log(f"Calling {func}"))
+                    log(i, backoff_level, calling_message)
                     result = func(*args, **kwargs)
-                    logger.debug(write_log('Successfully completed call'))
+                    log(i, backoff_level, 'Successfully completed call')
                     break
-                except rate_exceptions + timeout_exceptions as e:
-                    logger.debug(write_log('Rate or timeout error with function call', write_exception(e)))
-                    if i == retries:
-                        logger.debug(write_log("Re-raising..."))
-                        raise e
-                    delay = base_delay + ((spread * random()) - (spread / 2) if jitter else 0)
-                    if isinstance(e, rate_exceptions):
-                        backoff_level += 1
-                        if backoff: delay *= backoff_base ** backoff_level
-                    logger.debug(write_log(f"Sleep({round(delay, 1)}) and retry"))
+                except retry_exceptions as e:
+                    delay, backoff_level = retry_delay(e, i, backoff_level)
                     sleep(delay)
                 except Exception as e:
-                    logger.debug(write_log(
-                        'Error (unhandled) with function call',
-                        write_error(exception=e, re_raise=True, sep='\n')))
+                    log_unhandled(e, i, backoff_level)
                     raise e
                 i += 1
 
@@ -337,3 +398,164 @@ def retry(
         return wrapper
 
     return decorate
+
+
+# Token bucket for proactive rate limiting
+# ----------------------------------------
+
+class TokenBucket:
+    """Thread-safe token bucket to throttle calls before they are made
+
+    The bucket refills continuously at a rate (tokens per second) up to its
+    capacity. Tokens are reserved in order of calls: when the bucket lacks
+    tokens, the reservation is still taken (as a debt) and the caller waits
+    until it is paid back. When the rate limit is hit anyway, penalize()
+    decreases the rate multiplicatively, and the rate recovers additively with
+    each reservation (AIMD).
+
+    Params:
+    rate: Refill rate in tokens per second
+    capacity: Max. tokens in bucket (None for one minute of tokens at rate)
+    decrease_factor: Factor applied to the rate when penalized
+    increase_factor: Rate increase on reservation as a factor of initial rate
+    min_rate_factor: Min. rate as a factor of the initial rate
+    """
+
+    def __init__(
+            self, rate: float, capacity: float | None = None,
+            decrease_factor: float = 0.5, increase_factor: float = 0.01,
+            min_rate_factor: float = 0.1):
+        if rate <= 0: raise ValueError(f"Invalid rate {rate}, must be > 0")
+        self.max_rate: float = rate
+        self.min_rate: float = rate * min_rate_factor
+        self.capacity: float = rate * 60 if capacity is None else capacity
+        self.decrease_factor: float = decrease_factor
+        self.increase: float = rate * increase_factor
+        self._rate: float = rate
+        self._tokens: float = self.capacity
+        self._last_time: float = monotonic()
+        self._lock = Lock()
+
+    @classmethod
+    def per_minute(cls, limit: float, **kwargs):
+        """Create bucket from a limit per minute (e.g. requests or tokens)"""
+        return cls(limit / 60, capacity=limit, **kwargs)
+
+    @property
+    def rate(self) -> float: return self._rate
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + self._rate * (now - self._last_time))
+        self._last_time = now
+
+    def reserve(self, amount: float = 1) -> float:
+        """Take amount of tokens without waiting, return delay before use"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0
+            self._rate = min(self.max_rate, self._rate + self.increase)
+        return delay
+
+    def acquire(self, amount: float = 1) -> float:
+        """Wait for and take amount of tokens, return waiting time in seconds"""
+        delay = self.reserve(amount)
+        if delay > 0: sleep(delay)
+        return delay
+
+    async def async_acquire(self, amount: float = 1) -> float:
+        """Asynchronously wait for and take tokens, return waiting time"""
+        delay = self.reserve(amount)
+        if delay > 0: await async_sleep(delay)
+        return delay
+
+    def penalize(self) -> None:
+        """Decrease rate after a rate limit error"""
+        with self._lock:
+            self._refill()
+            self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+
+
+# Coalescing of identical concurrent calls
+# ----------------------------------------
+
+class _Batch:
+    """Calls coalesced in one batch (see Coalescer)"""
+
+    def __init__(self) -> None:
+        self.size: int = 1
+        self.closed = Event()
+        self.done = Event()
+        self.result: Any = None
+        self.exception: Exception | None = None
+
+
+def _copy_exception(e: Exception) -> Exception:
+    """Return copy of exception (without traceback) to raise it again"""
+    # Copy without calling __init__ (arguments may differ from args)
+    copy = e.__class__.__new__(e.__class__, *e.args)
+    copy.args = e.args
+    if hasattr(e, '__dict__'): copy.__dict__.update(e.__dict__)
+    copy.__cause__, copy.__context__ = e.__cause__, e.__context__
+    copy.__suppress_context__ = e.__suppress_context__
+    return copy
+
+
+class Coalescer:
+    """Thread-safe coalescing of identical concurrent calls into batches
+
+    The first call for a key waits up to window seconds (or until max_batch
+    calls are made with the same key), then makes one call for the whole batch.
+    The result is shared with each call of the batch along with its index. A
+    first call made while no other call is active doesn't wait.
+
+    Params:
+    window: Max. waiting time in seconds for other calls before calling
+    max_batch: Max. number of calls in a batch
+    """
+
+    def __init__(self, window: float = 0.02, max_batch: int = 16) -> None:
+        self.window: float = window
+        self.max_batch: int = max_batch
+        self._lock = Lock()
+        self._batches: dict[Hashable: _Batch] = {}
+        self._active: int = 0  # Calls in progress (waiting or calling)
+
+    def call(self, key: Hashable, func: Callable[[int], Any]) -> tuple[Any, int]:
+        """Return result of func(batch size) for batch of key and call index"""
+
+        with self._lock:
+            self._active += 1
+            alone = self._active == 1
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = _Batch()
+                index = 0
+            else:
+                index = batch.size
+                batch.size += 1
+                if batch.size >= self.max_batch:
+                    del self._batches[key]
+                    batch.closed.set()
+
+        try:
+            if index == 0:
+                if not alone: batch.closed.wait(self.window)
+                with self._lock:
+                    if self._batches.get(key) is batch: del self._batches[key]
+                try: batch.result = func(batch.size)
+                except Exception as e: batch.exception = e
+                finally: batch.done.set()
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock: self._active -= 1
+
+        # Exception raised by first call, and a copy by others (own traceback)
+        if batch.exception is not None:
+            if index == 0: raise batch.exception
+            raise _copy_exception(batch.exception)
+        return batch.result, index
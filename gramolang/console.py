@@ -3,9 +3,10 @@ Interactive Console
 """
 
 from typing import TextIO
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from datetime import datetime
+from time import monotonic
 
 from sys import stdin, stdout
 import readline
@@ -14,7 +15,7 @@ import textwrap
 from .common import (
     NAME_VERSION as PACKAGE_NAME_VERSION,
     COMMAND_CHAR, NONE_ARG, NAME_VALUE_SEPS,
-    now_delta, write_timedelta, write_error)
+    write_timedelta, write_error)
 from .command import (
     CommandClassError,
     Command, EmptyCommand, UnaryCommand, ToggleCommand,
@@ -22,7 +23,7 @@ from .command import (
 from .wraipi import APIWrapper
 from .chat import (
     Role,
-    SystemCommand,
+    SystemCommand, BatchCommand,
     MaxTokensCommand, TemperatureCommand, TopPCommand, ChoicesCommand,
     TimeoutCommand, RetriesCommand,
     ClearCommand, ResetCommand, ModelCommand,
@@ -40,6 +41,7 @@ def write_backspaces(string: str) -> str: return '\b \b' * len(string)
 
 class MessagesCommand(EmptyCommand):
     """Write all messages with role"""
+    __slots__ = ()
     NAMES = ('messages', 'mess')
 
     def __init__(self, *, name=NAMES[0]) -> None:
@@ -48,6 +50,7 @@ class MessagesCommand(EmptyCommand):
 
 class InfosCommand(ToggleCommand):
     """Toggle write more information about responses and status."""
+    __slots__ = ()
     NAMES = ('infos', 'i', 'info')
 
     def __init__(self, set_value: bool | None = None, name=NAMES[0]) -> None:
@@ -56,6 +59,7 @@ class InfosCommand(ToggleCommand):
 
 class RawCommand(ToggleCommand):
     """Toggle write raw response object and other data structures."""
+    __slots__ = ()
     NAMES = ('raw',)
 
     def __init__(self, set_value: bool | None = None, name=NAMES[0]) -> None:
@@ -64,14 +68,25 @@ class RawCommand(ToggleCommand):
 
 class WrapCommand(ToggleCommand):
     """Toggle wrap lines."""
+    __slots__ = ()
     NAMES = ('wrap',)
 
     def __init__(self, set_value: bool | None = None, name=NAMES[0]) -> None:
         super().__init__(set_value=set_value, name=name)
 
 
+class StreamCommand(ToggleCommand):
+    """Toggle stream responses as they are generated (without infos/raw)."""
+    __slots__ = ()
+    NAMES = ('stream',)
+
+    def __init__(self, set_value: bool | None = None, name=NAMES[0]) -> None:
+        super().__init__(set_value=set_value, name=name)
+
+
 class WidthCommand(UnaryCommand):
     """Set width for text wrap, write value if no argument."""
+    __slots__ = ()
     NAMES = ('width',)
 
     def __init__(self, arg: int | type(NONE_ARG) = NONE_ARG, name=NAMES[0]) -> None:
@@ -81,6 +96,7 @@ class WidthCommand(UnaryCommand):
 
 class StopCommand(EmptyCommand):
     """Stop console and return."""
+    __slots__ = ()
     NAMES = ('stop', 'q', 'quit', 'exit')
 
     def __init__(self, *, name=NAMES[0]) -> None:
@@ -89,6 +105,7 @@ class StopCommand(EmptyCommand):
 
 class HelpCommand(EmptyCommand):
     """Write help message."""
+    __slots__ = ()
     NAMES = ('help', 'h', '?')
 
     def __init__(self, *, name=NAMES[0]) -> None:
@@ -114,6 +131,8 @@ class Console:
     _RESPONSE_TIME_LABEL = 'Time: '  # Label for printing response time
     _INTERVAL = 0.1                  # Refresh interval from printing response time
     _NDIGITS = 2                     # Number of digits for rounding seconds
+    _ERASE_LINE = '\r\x1b[2K'        # Terminal codes to erase line (TTY only)
+    _COMMANDS_CACHE_SIZE = 128       # Max. number of parsed commands cached
 
     def __init__(
             self,
@@ -131,7 +150,12 @@ class Console:
         self._infos: bool = False   # Write more information about responses
         self._raw: bool = False     # Write raw response completion instance
         self._wrap: bool = False    # Wrap lines to a specific width
+        self._stream: bool = False  # Stream responses (if no infos or raw)
         self._width: int = 80       # Width for line break
+        self._text_wrapper: textwrap.TextWrapper | None = None  # For width
+
+        # Parsed commands by input string (least recently used first)
+        self._commands_cache: OrderedDict[str: Command] = OrderedDict()
 
     @property
     def running(self): return self._running
@@ -146,6 +170,10 @@ class Console:
     def write_line(self, *args, **kwargs):
         self.write(*args, **kwargs, end='\n')
 
+    def _erase_line(self, line: str) -> str:
+        """Return terminal codes to erase line (nothing if empty)"""
+        return self._ERASE_LINE if line else ''
+
     def write_value(self, name: str, value):
         self.write_line(f"{name} {NAME_VALUE_SEPS[0]}", value.__repr__())
 
@@ -166,8 +194,7 @@ class Console:
         messages = self.chat.role_messages(role) if role else self.chat.messages
         for m in messages: self.write_line(f"{m.role}: {m.content}")
         self.write_line(
-            'No' if len(messages) == 0 else str(len(messages)),
-            f"{str(role) + ' ' if role else ''}message(s) in chat")
+            f"{len(messages) or 'No'} {f'{role} ' if role else ''}message(s) in chat")
 
     def system(self, message: str | None = None):
         """Add system message or write all system messages."""
@@ -176,6 +203,12 @@ class Console:
         else:
             self.messages(Role.SYSTEM)
 
+    def batch(self, path: str):
+        """Complete each line of file in one request and write responses."""
+        with open(path, encoding='utf-8') as file:
+            responses = self.chat.batch_complete_lines(file.read())
+        for i, response in enumerate(responses): self.write_line(f"[{i}] {response}")
+
     def max_tokens(self, value: int | None | type(NONE_ARG) = NONE_ARG):
         """Set/print max. number of tokens for chat completion."""
         if value is not NONE_ARG: self.chat.max_tokens = value
@@ -227,8 +260,12 @@ class Console:
 
     def wrap(self, set_value: bool | None = None): self._toggle('wrap', set_value)
 
+    def stream(self, set_value: bool | None = None): self._toggle('stream', set_value)
+
     def width(self, value: int | type(NONE_ARG) = NONE_ARG):
-        if value is not NONE_ARG: self._width = int(value)
+        if value is not NONE_ARG:
+            self._width = int(value)
+            self._text_wrapper = None
         else: self.write_value(f"Width", self._width)
 
     # Other commands
@@ -246,22 +283,30 @@ class Console:
     # -----------------
 
     commands = Commands({
-        MessagesCommand: messages, SystemCommand: system,
+        MessagesCommand: messages, SystemCommand: system, BatchCommand: batch,
         MaxTokensCommand: max_tokens, TemperatureCommand: temperature,
         TopPCommand: top_p, ChoicesCommand: choices,
         TimeoutCommand: timeout, RetriesCommand: retries,
         ClearCommand: clear, ResetCommand: reset,
         ModelCommand: model,
         InfosCommand: infos, RawCommand: raw,
-        WrapCommand: wrap, WidthCommand: width,
+        WrapCommand: wrap, WidthCommand: width, StreamCommand: stream,
         StopCommand: stop,
         HelpCommand: write_help})
 
     def execute(self, command: type | Command | str):
-        self.commands.instance_execute(self, command)
+        return self.commands.instance_execute(self, command)
 
     def parse_execute(self, string: str):
-        self.commands.parse_instance_execute(self, string)
+        command = self._commands_cache.get(string)
+        if command is None:
+            command = self.commands.parse(string)
+            self._commands_cache[string] = command
+            if len(self._commands_cache) > self._COMMANDS_CACHE_SIZE:
+                self._commands_cache.popitem(last=False)
+        else:
+            self._commands_cache.move_to_end(string)
+        return self.commands.instance_execute(self, command)
 
     # Main run
     # --------
@@ -275,18 +320,23 @@ class Console:
         self.write_line(f"{PACKAGE_NAME_VERSION} {self.NAME}")
         self.write_line(f"Model: {self.chat.model()}")
 
+        # Erase timer line with terminal codes if possible (else backspaces)
+        erase = self._erase_line if self.OUTPUT_FILE.isatty() else write_backspaces
+
         # Executor for completion thread
         with ThreadPoolExecutor(max_workers=1) as executor:
 
             # Main prompt/command and response loop
             while self._running:
 
-                # Prompt for input
+                # Prompt for input (skip empty input)
                 user_input = input(self.INPUT_PROMPT)
+                if not user_input or user_input.isspace(): continue
 
                 # Process input for command or message
-                if user_input.startswith(COMMAND_CHAR):
+                if user_input[0] == COMMAND_CHAR:
                     command = user_input[1:]
+                    if not command: continue
                     try: self.parse_execute(command)
                     except CommandClassError:
                         self.write_line("Invalid command name")
@@ -297,22 +347,31 @@ class Console:
                 # If not a command, add user message
                 self.chat.append_user_message(user_input)
 
+                # Stream response (written as it is generated)
+                if self._stream and not (self._infos or self._raw):
+                    try:
+                        for part in self.chat.complete_stream(): self.write(part)
+                        self.write_line()
+                    except Exception as e:
+                        self.write_line(write_error(e))
+                    continue
+
                 # Complete request and print timer
                 # TODO: Implement completion cancel mechanism
-                start = datetime.now()
+                start = monotonic()
                 future = executor.submit(
                     self.chat.complete, append_completion=True)
 
                 time_delta_line = ''
                 while not future.done():
-                    time_delta = now_delta(start)
-                    self.write(write_backspaces(time_delta_line))
-                    time_delta_line = (
+                    line = (
                         f"{self._RESPONSE_TIME_LABEL}"
-                        f"{write_timedelta(time_delta, self._NDIGITS)}")
-                    self.write(time_delta_line)
+                        f"{write_timedelta(monotonic() - start, self._NDIGITS)}")
+                    if line != time_delta_line:  # Redraw only if changed
+                        self.write(erase(time_delta_line), line, sep='')
+                        time_delta_line = line
                     wait((future,), timeout=self._INTERVAL)
-                self.write(write_backspaces(time_delta_line))
+                self.write(erase(time_delta_line))
 
                 if future.exception():
                     self.write_line(write_error(future.exception()))
@@ -325,12 +384,19 @@ class Console:
                     self.write_line(f"request = {request}")
                     self.write_line(f"response = {response}")
                 else:
-                    for i, choice in enumerate(response.choices):
-                        if len(response.choices) > 1: self.write_line(f"\nChoice {i}:")
-                        if self._wrap:
-                            for time_delta_line in textwrap.wrap(choice.message.content, self._width):
-                                self.write_line(time_delta_line)
-                        else: self.write_line(choice.message.content)
+                    choices = response.choices
+                    multiple = len(choices) > 1
+                    wrap = None
+                    if self._wrap:
+                        if self._text_wrapper is None:
+                            self._text_wrapper = textwrap.TextWrapper(self._width)
+                        wrap = self._text_wrapper.wrap
+                    for i, choice in enumerate(choices):
+                        if multiple: self.write_line(f"\nChoice {i}:")
+                        content = choice.message.content
+                        if wrap is not None:
+                            for line in wrap(content): self.write_line(line)
+                        else: self.write_line(content)
 
                 # Print information
                 if self._infos:
@@ -5,111 +5,289 @@ TODO: Create template.xlsx with help, and docstring to agent.setters...
 TODO: Fix ResourceWarning: unclosed <ssl.SSLSocket for unittest testing
 """
 
-from typing import Sequence
+from typing import NamedTuple, Sequence
 from logging import getLogger
 
 from datetime import datetime
 from pathlib import Path
-from threading import Lock
+from itertools import count, zip_longest
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from openpyxl import load_workbook
-from openpyxl.styles import Font
-from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
-from openpyxl.utils.exceptions import IllegalCharacterError
+from asyncio import Semaphore, create_task, gather
+from contextvars import copy_context
 
 from .common import (
     COMMENT_CHAR,
     now_delta, write_now_delta, join_none, rmark,
     write_exception, write_error)
-from .wraipi import APIWrapper
+from .wraipi import (
+    APIWrapper, MODEL_TO_APIWRAPPER, rate_limits)
 from .command import EmptyCommand
-from .chat import Chat, CompleteCommand
+from .chat import Chat, CompleteCommand, AsyncCompleteCommand, BatchCommand
+
+# Note: openpyxl (slow to import) is imported on use by the workbook functions
 
 
 # Separator for chat id
 CHAT_ID_SEP = '-'
 
-# Font Style for Error Cell
-COMPLETE_FONT = Font(color='0000FF')
-ERROR_FONT = Font(bold=True, color='FF0000')
+# Default max. concurrent chat completions (waiting on network, not CPUs)
+MAX_CHATS = 32
+
+# Font Style for Completion and Error Cell (COMPLETE_FONT and ERROR_FONT openpyxl
+# Font instances, created from these arguments on first use, see _font)
+_FONT_KWARGS = {
+    'COMPLETE_FONT': {'color': '0000FF'},
+    'ERROR_FONT': {'bold': True, 'color': 'FF0000'}}
 
 # Logging
 module_logger = getLogger(__name__)
 
 
-def _modify_cell(cell, lock, value, error=False):
-    lock.acquire()
+def _font(name: str):
+    """Return module font (created on first use, unless set by caller)"""
+    font = globals().get(name)
+    if font is None:
+        from openpyxl.styles import Font
+        font = globals().setdefault(name, Font(**_FONT_KWARGS[name]))
+    return font
+
+
+def __getattr__(name: str):
+    if name in _FONT_KWARGS: return _font(name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+class _Column(NamedTuple):
+    """Column of values to complete"""
+    name: str
+    title: str
+    column: int
+    plan: list[tuple]
+    values: tuple
+    call_id: str
+
+
+def _read_columns(
+        workbook_path, sheet_name_matches, file_id, logger) -> list[_Column]:
+    """Read columns to complete (read-only, only values are needed)"""
+    from openpyxl import load_workbook
+
+    columns = []
+
+    # Formulas are read as text (as before), not as cached values (None in
+    # workbooks never saved by Excel)
+    wb = load_workbook(filename=workbook_path, read_only=True)
     try:
-        if error: cell.font = ERROR_FONT
-        else: cell.font = COMPLETE_FONT
-        cell.value = value
-    except Exception as e:
-        if error and isinstance(e, IllegalCharacterError):
-            # Note: models can output illegal cell character for Excel (especially
-            # at high temperature setting). This handler ensures that the error
-            # message will be printed in the cell without raising another
-            # exception. The original output should raise an exception and won't
-            # be printed in the cell, only the formatted error message.
-            cell.value = ILLEGAL_CHARACTERS_RE.sub(r'', value)
-        else:
-            raise e
+
+        # Sheets loop
+        i_sheet = -1
+        for sheet in wb.worksheets:
+
+            # Test for skipping sheet
+            if (
+                    (sheet_name_matches and sheet.title.lower() not in sheet_name_matches) or
+                    sheet.title.startswith(COMMENT_CHAR)):
+                continue
+            logger.info(f"Accessing worksheet '{sheet.title}'{rmark(file_id)}")
+
+            # Columns of values (rows read once and transposed)
+            cols = list(zip_longest(*sheet.iter_rows(values_only=True)))
+
+            # Get params
+            command_names = None
+            i_command_col = 0
+            for i_command_col, col in enumerate(cols):
+                if str(col[0]).startswith(COMMENT_CHAR): continue
+                i_sheet += 1
+                sheet_id = f"chat {i_sheet}"
+                command_names = [str(value).strip().lower() for value in col[1:]]
+                logger.info(
+                    f"Command sequence{rmark(file_id, join_none(sheet_id, 'x', sep=CHAT_ID_SEP))}: "
+                    f"{', '.join(command_names)}")
+                break
+            if command_names is None:
+                logger.info(f"Cannot find command, skipping empty sheet{rmark(file_id)}")
+                continue
+            plan = _plan_commands(command_names)
+
+            # Columns iteration in sheet
+            for i_col in range(i_command_col + 1, len(cols)):
+                col = cols[i_col]
+                if str(col[0]).startswith(COMMENT_CHAR): continue
+                call_id = join_none(
+                    file_id, join_none(sheet_id, len(columns), sep=CHAT_ID_SEP))
+                columns.append(_Column(
+                    f"column '{col[0]}'{rmark(call_id)}", sheet.title, i_col + 1,
+                    plan, col[1:], call_id))
+
     finally:
-        lock.release()
+        wb.close()
 
+    return columns
 
-def _complete_col(
-        name, command_names, col, api_keys, model,
-        timeout, retries, lock, call_id):
 
-    start = datetime.now()
-    logger = module_logger.getChild(_complete_col.__name__)
-    logger.info(f"Starting chat completion of {name}")
+def _write_results(
+        workbook_path, new_workbook_path, sheet_results, file_id, logger) -> None:
+    """Write results in workbook (single-threaded) and save"""
+    from openpyxl import load_workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 
-    exceptions = []
-    chat = Chat(api_keys=api_keys)
+    complete_font, error_font = _font('COMPLETE_FONT'), _font('ERROR_FONT')
+    wb = load_workbook(filename=workbook_path)
+    for title, column, results in sheet_results:
+        sheet = wb[title]
+        for j, value, error in results:
+            cell = sheet.cell(row=j + 2, column=column)
+            cell.font = error_font if error else complete_font
+            # Note: models can output illegal cell character for Excel (especially
+            # at high temperature setting). These characters are always removed
+            # instead of raising an exception for the completion.
+            if isinstance(value, str): value = ILLEGAL_CHARACTERS_RE.sub(r'', value)
+            cell.value = value
+    if new_workbook_path is None: new_workbook_path = workbook_path
+    logger.info(f"Saving workbook{rmark(file_id)}: {new_workbook_path}")
+    wb.save(new_workbook_path)
+
+
+def _create_chat(api_keys, api_wrappers, model, timeout, retries) -> Chat:
+    chat = Chat(api_keys=api_keys, api_wrappers=api_wrappers)
     chat.model(model)
     if timeout is not None: chat.timeout = timeout
     if retries is not None: chat.retries = retries
+    return chat
 
-    # Cell loop
-    idx = -1
-    for j, cell in enumerate(col[1:]):
 
-        # Skip line of commented command
-        if command_names[j].startswith(COMMENT_CHAR): continue
+def _plan_commands(command_names) -> list[tuple]:
+    """Return (row index, name, class, empty, completion id) for each command
 
-        try:
+    Commented commands are skipped, class is None for an unknown name, and
+    completion id is None except for completion commands.
+    """
+    plan = []
+    completion_ids = count()
+    for j, name in enumerate(command_names):
+        if name.startswith(COMMENT_CHAR): continue
+        cls = Chat.commands[name] if name in Chat.commands else None
+        if cls is not None and issubclass(cls, (CompleteCommand, AsyncCompleteCommand)):
+            plan.append((j, name, cls, False, f"idx {next(completion_ids)}"))
+        else:
+            plan.append((
+                j, name, cls, cls is not None and issubclass(cls, EmptyCommand), None))
+    return plan
+
+
+def _col_commands(name, plan, values, chat, complete_class, call_id, logger):
+    """Yield commands for column values and return exceptions and results
+
+    Each command's return value (or exception) is sent back to the generator,
+    so synchronous and asynchronous execution share the same handling.
+    Results are (row index, value, error) tuples for the values to write, with
+    row indexes relative to the first value.
+    """
+
+    start = datetime.now()
+    logger.info(f"Starting chat completion of {name}")
 
-            # Create command instance
-            if issubclass(chat.commands[command_names[j]], EmptyCommand):
-                command = chat.commands[command_names[j]](
-                    name=command_names[j])
-            else:
-                command = chat.commands[command_names[j]](
-                    cell.value, name=command_names[j])
-
-            # Process CompleteCommand
-            if isinstance(command, CompleteCommand):
-                idx += 1
-                completion_call_id = f"idx {idx}"
-                command = CompleteCommand(call_id=join_none(call_id, completion_call_id))
-
-            # Execute command
-            chat.execute(command)
-            if isinstance(command, CompleteCommand):
-                _modify_cell(cell, lock, chat.last_assistant_message())
+    exceptions = []
+    results = []
+
+    # Command loop
+    for j, command_name, cls, empty, completion_id in plan:
+        try:
+            if cls is None: chat.commands[command_name]  # Raise error
+            if completion_id is not None:
+                yield complete_class(call_id=join_none(call_id, completion_id))
+                results.append((j, chat.last_assistant_message(), False))
+            elif empty: yield cls(name=command_name)
+            elif cls is BatchCommand:
+                responses = yield cls(values[j], name=command_name)
+                results.append((j, '\n'.join(responses), False))
+            else: yield cls(values[j], name=command_name)
 
         except Exception as e:
             exceptions.append(e)
             logger.warning(write_error(e, name, now_delta(start), sep=': '))
-            _modify_cell(cell, lock, write_exception(e), error=True)
+            results.append((j, write_exception(e), True))
 
     # Finish message
     logger.info(f"Completed {name} in {write_now_delta(start)}")
 
-    # Return exceptions or None
-    if exceptions: return exceptions
-    else: return None
+    # Return exceptions (or None) and results
+    return (exceptions if exceptions else None), results
+
+
+def _complete_col(
+        name, plan, values, api_keys, api_wrappers, model,
+        timeout, retries, call_id):
+    """Complete column values and return exceptions and results"""
+
+    chat = _create_chat(api_keys, api_wrappers, model, timeout, retries)
+    commands = _col_commands(
+        name, plan, values, chat, CompleteCommand, call_id,
+        module_logger.getChild(_complete_col.__name__))
+
+    # Execute commands until the generator returns
+    try:
+        command = next(commands)
+        while True:
+            try: value = chat.execute(command)
+            except Exception as e: command = commands.throw(e)
+            else: command = commands.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _acomplete_col(
+        name, plan, values, api_keys, api_wrappers, model,
+        timeout, retries, call_id):
+    """Complete column values asynchronously, see _complete_col"""
+
+    chat = _create_chat(api_keys, api_wrappers, model, timeout, retries)
+    commands = _col_commands(
+        name, plan, values, chat, AsyncCompleteCommand, call_id,
+        module_logger.getChild(_acomplete_col.__name__))
+
+    # Execute commands (completions asynchronously) until the generator returns
+    try:
+        command = next(commands)
+        while True:
+            try: value = await chat.aexecute(command)
+            except Exception as e: command = commands.throw(e)
+            else: command = commands.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+
+def _setup(
+        workbook_path, model, api_keys, file_id, logger) -> dict[type(APIWrapper): APIWrapper]:
+    """Log start and return API wrappers shared by all chats"""
+
+    logger.info(
+        f"Starting workbook chat completion{rmark(file_id)}: {workbook_path}")
+
+    # Additional debug information
+    logger.debug(f"File identification (id): {file_id}")
+    logger.debug(f"Model{rmark(file_id)}: {model}")
+
+    # API wrapper for model shared by all chats (and their client connections)
+    api_wrappers = {}
+    api_wrapper_class = MODEL_TO_APIWRAPPER.get(model)
+    if api_wrapper_class is not None:
+        api_wrappers[api_wrapper_class] = api_wrapper_class(
+            api_key=None if api_keys is None else api_keys.get(api_wrapper_class))
+    return api_wrappers
+
+
+def _finish(i_chat, exceptions, start, file_id, logger):
+    """Log final message and return exceptions (or None)"""
+    end = f"workbook with {i_chat} chat(s){rmark(file_id)} in {write_now_delta(start)}"
+    if len(exceptions) > 0:
+        logger.warning(f"{len(exceptions)} error(s) completing {end}")
+    elif i_chat == 0:
+        logger.info(f"Finished processing {end}")
+    else:
+        logger.info(f"Successfully completed {end}")
+    return exceptions if len(exceptions) > 0 else None
 
 
 def complete(
@@ -119,112 +297,141 @@ def complete(
         model: str = Chat.MODELS[0],
         timeout: int | None = None, retries: int | None = 0,
         max_chats: int | None = None,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
         file_id: str | int | None = None):
     """Complete chats in Excel workbook columns
 
     Excel sheet format
     - Values starting with COMMENT_SUFFIX are considered comments
+    - Completions replace command values
+    - Batch values (one input per line) are replaced by responses (one per line)
     - All columns and all sheets in workbook will be completed by default
       Comment name of sheet or header to skip sheet or column
     - Params are read from the first column with non-commented heading (including None)
 
+    Columns are completed in threads, at most max_chats at a time (MAX_CHATS
+    if None, and never more threads than columns).
+
+    Rate limits (if any given) replace the limits of the model for the
+    completions of the call (see wraipi.rate_limits), shared by all columns
+    instead of retrying on rate limit errors.
+
     OpenAI API Key must be set prior to function call, see set_openai_api_key()
     """
 
     start = datetime.now()
     logger = module_logger.getChild(complete.__name__)
+    api_wrappers = _setup(workbook_path, model, api_keys, file_id, logger)
 
-    # Load workbook and sheet
-    logger.info(
-        f"Starting workbook chat completion{rmark(file_id)}: {workbook_path}")
-    wb = load_workbook(filename=workbook_path)
-
-    # Additional debug information
-    logger.debug(f"File identification (id): {file_id}")
-    logger.debug(f"Model{rmark(file_id)}: {model}")
-
-    # Setup sheet_names
+    # Read columns
     sheet_name_matches = None
     if sheet_names is not None:
         sheet_name_matches = tuple(name.lower() for name in sheet_names)
+    columns = _read_columns(workbook_path, sheet_name_matches, file_id, logger)
 
     # Concurrent completion of all columns
-    i_chat = 0
-    with ThreadPoolExecutor(max_workers=max_chats) as executor:
+    # (columns' threads run a copy of the context with the rate limits)
+    max_workers = max(1, min(MAX_CHATS if max_chats is None else max_chats, len(columns)))
+    with (
+            rate_limits((model,), requests_per_minute, tokens_per_minute),
+            ThreadPoolExecutor(max_workers=max_workers) as executor):
 
-        # Workbook lock for modification (for openpyxl)
-        lock = Lock()
-
-        # Futures dictionary {future: name}
+        # Futures dictionary {future: column}
         future_completes = {}
-
-        # Sheets loop
-        i_sheet = -1
-        for sheet in wb.worksheets:
-
-            # Test for skipping sheet
-            if (
-                    (sheet_name_matches and sheet.title.lower() not in sheet_name_matches) or
-                    sheet.title.startswith(COMMENT_CHAR)):
-                continue
-            logger.info(f"Accessing worksheet '{sheet.title}'{rmark(file_id)}")
-
-            # Get params
-            command_names = None
-            i_command_col = 0
-            for i_command_col, col in enumerate(sheet.iter_cols()):
-                if str(col[0].value).startswith(COMMENT_CHAR): continue
-                i_sheet += 1
-                sheet_id = f"chat {i_sheet}"
-                command_names = [str(cell.value).strip().lower() for cell in col[1:]]
-                logger.info(
-                    f"Command sequence{rmark(file_id, join_none(sheet_id, 'x', sep=CHAT_ID_SEP))}: "
-                    f"{', '.join(command_names)}")
-                break
-            if command_names is None:
-                logger.info(f"Cannot find command, skipping empty sheet{rmark(file_id)}")
-                continue
-
-            # Columns iteration in sheet
-            for col in sheet.iter_cols(min_col=i_command_col + 1 + 1):
-                if str(col[0].value).startswith(COMMENT_CHAR): continue
-                call_id = join_none(
-                    file_id, join_none(sheet_id, i_chat, sep=CHAT_ID_SEP))
-                name = f"column '{col[0].value}'{rmark(call_id)}"
-                logger.info(f"Pooling {name}")
-                future = executor.submit(
-                    _complete_col, name=name, command_names=command_names, col=col,
-                    api_keys=api_keys, model=model,
-                    timeout=timeout, retries=retries, lock=lock,
-                    call_id=call_id)
-                future_completes[future] = name
-                i_chat += 1
+        for col in columns:
+            logger.info(f"Pooling {col.name}")
+            future = executor.submit(
+                copy_context().run, _complete_col, name=col.name, plan=col.plan,
+                values=col.values, api_keys=api_keys,
+                api_wrappers=api_wrappers, model=model,
+                timeout=timeout, retries=retries, call_id=col.call_id)
+            future_completes[future] = col
 
         # Wait for all future to complete and manage exceptions
         exceptions = []
+        sheet_results = []
         for future in as_completed(future_completes, timeout=None):
+            col = future_completes[future]
             if future.exception() is not None:
                 logger.critical(
                     write_error(
-                        future.exception(), future_completes[future], re_raise=True,
-                        sep='\n'))
+                        future.exception(), col.name, re_raise=True, sep='\n'))
+                # Cancel pending columns (errors in cells are handled by columns)
+                executor.shutdown(wait=False, cancel_futures=True)
                 raise future.exception()
-            elif future.result() is not None:
-                exceptions.append(future.result())
+            col_exceptions, results = future.result()
+            if col_exceptions is not None: exceptions.append(col_exceptions)
+            sheet_results.append((col.title, col.column, results))
 
-    # Save workbook
-    if new_workbook_path is None: new_workbook_path = workbook_path
-    logger.info(f"Saving workbook{rmark(file_id)}: {new_workbook_path}")
-    wb.save(new_workbook_path)
+    _write_results(workbook_path, new_workbook_path, sheet_results, file_id, logger)
+    return _finish(len(columns), exceptions, start, file_id, logger)
 
-    # Final message
-    end = f"workbook with {i_chat} chat(s){rmark(file_id)} in {write_now_delta(start)}"
-    if len(exceptions) > 0:
-        logger.warning(f"{len(exceptions)} error(s) completing {end}")
-    elif i_chat == 0:
-        logger.info(f"Finished processing {end}")
-    else:
-        logger.info(f"Successfully completed {end}")
 
-    # Return
-    return exceptions if len(exceptions) > 0 else None
+async def acomplete(
+        workbook_path: Path | str, new_workbook_path: Path | str = None,
+        sheet_names: Sequence[str] | None = None,
+        api_keys: dict[type(APIWrapper): str] | None = None,
+        model: str = Chat.MODELS[0],
+        timeout: int | None = None, retries: int | None = 0,
+        max_chats: int | None = None,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        file_id: str | int | None = None):
+    """Complete chats in Excel workbook columns asynchronously, see complete
+
+    Columns are completed concurrently in the event loop instead of threads,
+    at most max_chats at a time (None for no max.). Identical completions are
+    not coalesced (see wraipi.set_coalescing). Asynchronous clients of the
+    running loop are shared with other completions and left open: close them
+    when done (see wraipi.aclose_openai_clients).
+    """
+
+    start = datetime.now()
+    logger = module_logger.getChild(acomplete.__name__)
+    api_wrappers = _setup(workbook_path, model, api_keys, file_id, logger)
+
+    # Read columns
+    sheet_name_matches = None
+    if sheet_names is not None:
+        sheet_name_matches = tuple(name.lower() for name in sheet_names)
+    columns = _read_columns(workbook_path, sheet_name_matches, file_id, logger)
+
+    # Concurrent completion of all columns
+    semaphore = Semaphore(max_chats) if max_chats is not None else None
+
+    async def complete_col(col: _Column):
+        try:
+            if semaphore is None:
+                return await _acomplete_col(
+                    col.name, col.plan, col.values, api_keys,
+                    api_wrappers, model, timeout, retries, col.call_id)
+            async with semaphore:
+                return await _acomplete_col(
+                    col.name, col.plan, col.values, api_keys,
+                    api_wrappers, model, timeout, retries, col.call_id)
+        except Exception as e:
+            logger.critical(write_error(e, col.name, re_raise=True, sep='\n'))
+            raise e
+
+    tasks = []
+    with rate_limits((model,), requests_per_minute, tokens_per_minute):
+        try:
+            for col in columns:
+                logger.info(f"Pooling {col.name}")
+                tasks.append(create_task(complete_col(col)))
+            col_results = await gather(*tasks)
+        finally:
+            # Wait for cancelled tasks (no column left running on return)
+            for task in tasks: task.cancel()
+            await gather(*tasks, return_exceptions=True)
+
+    # Manage exceptions
+    exceptions = []
+    sheet_results = []
+    for col, (col_exceptions, results) in zip(columns, col_results):
+        if col_exceptions is not None: exceptions.append(col_exceptions)
+        sheet_results.append((col.title, col.column, results))
+
+    _write_results(workbook_path, new_workbook_path, sheet_results, file_id, logger)
+    return _finish(len(columns), exceptions, start, file_id, logger)
@@ -6,20 +6,191 @@ for all models.
 
 """
 import logging
-from typing import Any, Sequence
+from typing import Any, Sequence, Iterator
 from logging import getLogger
 from pathlib import Path
 from os import environ
 from datetime import datetime
+from contextlib import contextmanager
+from threading import Lock
+from types import MappingProxyType
+from weakref import WeakKeyDictionary
+from asyncio import get_running_loop
+from contextvars import ContextVar
 
-from openai import OpenAI, RateLimitError, APITimeoutError
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APITimeoutError
 
-from .common import Model, Message, retry
+from .common import Model, Message, TokenBucket, Coalescer, retry
+
+
+# Estimation of tokens for rate limiting
+CHARS_PER_TOKEN = 4             # Approximate number of characters per token
+COMPLETION_TOKENS = 512         # Completion tokens if no max. tokens
+
+# Rate limits token buckets by model (see set_rate_limits)
+_RPM_BUCKETS: dict[str: TokenBucket] = {}
+_TPM_BUCKETS: dict[str: TokenBucket] = {}
+
+# Rate limits token buckets by model of calls in context (requests and tokens),
+# and buckets shared by calls with the same limit with their number of calls
+# (see rate_limits)
+_CALL_BUCKETS: ContextVar[tuple[dict, dict]] = ContextVar(
+    'call_buckets', default=({}, {}))
+_SHARED_CALL_BUCKETS: dict[tuple: list] = {}
+_CALL_BUCKETS_LOCK = Lock()
+
+# Coalescer of identical concurrent chat completions (see set_coalescing)
+_COALESCER: Coalescer | None = None
+
+# API wrapper classes by model (registered by APIWrapper subclasses)
+_MODEL_TO_APIWRAPPER: dict[str: type] = {}
+
+# OpenAI clients shared by API key (see openai_client)
+_OPENAI_CLIENTS: dict[str: OpenAI] = {}
+_OPENAI_CLIENTS_LOCK = Lock()
+
+# Asynchronous OpenAI clients shared by event loop and API key (see
+# async_openai_client)
+_ASYNC_OPENAI_CLIENTS: WeakKeyDictionary = WeakKeyDictionary()
 
 # Logging
 module_logger = getLogger(__name__)
 
 
+def set_rate_limits(
+        model: str,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None) -> None:
+    """Set (or remove with None) proactive rate limits for model
+
+    Limits are shared by all API wrappers (and threads) completing chats with
+    the model: calls wait for their turn instead of hitting rate limit errors.
+    """
+    for buckets, limit in (
+            (_RPM_BUCKETS, requests_per_minute),
+            (_TPM_BUCKETS, tokens_per_minute)):
+        if limit is None: buckets.pop(model, None)
+        else: buckets[model] = TokenBucket.per_minute(limit)
+
+
+@contextmanager
+def rate_limits(
+        models: Sequence[str],
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None):
+    """Set rate limits for models within context (see set_rate_limits)
+
+    Limits apply only to completions made in the context (and in tasks or
+    threads running a copy of it), without changing the limits of other calls.
+    Only the given limits replace those of the models, and calls with the same
+    limit for a model share its bucket (including the one of set_rate_limits).
+    """
+    keys = []
+    for model in models:
+        for i, (buckets, limit) in enumerate((
+                (_RPM_BUCKETS, requests_per_minute),
+                (_TPM_BUCKETS, tokens_per_minute))):
+            bucket = buckets.get(model)
+            if limit is None or (bucket is not None and bucket.capacity == limit):
+                continue
+            keys.append((i, model, limit))
+
+    # Acquire buckets shared by calls with the same limits
+    call_buckets = tuple(dict(b) for b in _CALL_BUCKETS.get())
+    with _CALL_BUCKETS_LOCK:
+        for key in keys:
+            shared = _SHARED_CALL_BUCKETS.setdefault(
+                key, [TokenBucket.per_minute(key[2]), 0])
+            shared[1] += 1
+            call_buckets[key[0]][key[1]] = shared[0]
+
+    token = _CALL_BUCKETS.set(call_buckets)
+    try:
+        yield
+    finally:
+        _CALL_BUCKETS.reset(token)
+        with _CALL_BUCKETS_LOCK:
+            for key in keys:
+                shared = _SHARED_CALL_BUCKETS[key]
+                shared[1] -= 1
+                if shared[1] == 0: del _SHARED_CALL_BUCKETS[key]
+
+
+def _model_buckets(model: str) -> tuple[TokenBucket | None, TokenBucket | None]:
+    """Return requests and tokens per minute buckets of model in context"""
+    call_rpm_buckets, call_tpm_buckets = _CALL_BUCKETS.get()
+    return (
+        call_rpm_buckets.get(model, _RPM_BUCKETS.get(model)),
+        call_tpm_buckets.get(model, _TPM_BUCKETS.get(model)))
+
+
+def set_coalescing(window: float | None = 0.02, max_batch: int = 16) -> None:
+    """Set (or remove with None) coalescing of identical chat completions
+
+    Identical chat completions (same API key, messages and parameters, and
+    without choices) made concurrently within window seconds are sent as one
+    request with a choice for each completion (e.g. identical first prompt in
+    many conversations).
+    """
+    global _COALESCER
+    _COALESCER = None if window is None else Coalescer(window, max_batch)
+
+
+def openai_client(api_key: str) -> OpenAI:
+    """Return OpenAI client shared for API key (and its connection pool)"""
+    with _OPENAI_CLIENTS_LOCK:
+        if api_key not in _OPENAI_CLIENTS:
+            _OPENAI_CLIENTS[api_key] = OpenAI(api_key=api_key)
+        return _OPENAI_CLIENTS[api_key]
+
+
+def close_openai_clients() -> None:
+    """Close shared OpenAI clients (and their connection pools)
+
+    Shared clients are thread-safe and can be used by any number of API
+    wrappers and chats. Clients are created again on next use (API wrappers
+    get their shared client on each use, see OpenAIWrapper.client).
+    """
+    with _OPENAI_CLIENTS_LOCK:
+        for client in _OPENAI_CLIENTS.values(): client.close()
+        _OPENAI_CLIENTS.clear()
+
+
+def async_openai_client(api_key: str) -> AsyncOpenAI:
+    """Return asynchronous OpenAI client shared for API key in running loop
+
+    Connections of asynchronous clients are bound to their event loop, so
+    clients are shared by event loop (see aclose_openai_clients).
+    """
+    loop = get_running_loop()
+    with _OPENAI_CLIENTS_LOCK:
+        clients = _ASYNC_OPENAI_CLIENTS.setdefault(loop, {})
+        if api_key not in clients: clients[api_key] = AsyncOpenAI(api_key=api_key)
+        return clients[api_key]
+
+
+async def aclose_openai_clients() -> None:
+    """Close asynchronous OpenAI clients of running loop (and their pools)
+
+    Clients are created again on next use in the loop.
+    """
+    loop = get_running_loop()
+    with _OPENAI_CLIENTS_LOCK: clients = _ASYNC_OPENAI_CLIENTS.pop(loop, {})
+    for client in clients.values(): await client.close()
+
+
+def estimate_tokens(
+        messages: Sequence[Message], max_tokens: int | None = None,
+        choices: int | None = None) -> int:
+    """Estimate tokens of a chat completion (prompt and completions)
+
+    Messages without content (e.g. refused completion) count for no tokens.
+    """
+    prompt_tokens = sum(len(m.content or '') // CHARS_PER_TOKEN for m in messages)
+    completion_tokens = COMPLETION_TOKENS if max_tokens is None else max_tokens
+    return prompt_tokens + completion_tokens * (1 if choices is None else choices)
+
+
 class APIWrapper:
     """Base inheritable class for API wrapper classes"""
 
@@ -27,6 +198,14 @@ class APIWrapper:
     API_KEY_NAMES: tuple[str] = ()
     MODELS: set[str] = set()
 
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if 'MODELS' not in cls.__dict__: return  # Inherited models
+        for model in cls.MODELS:
+            if model in _MODEL_TO_APIWRAPPER:
+                raise KeyError(f"Model '{model}' already exists.")
+            _MODEL_TO_APIWRAPPER[model] = cls
+
     def __init__(self, api_key: str | None = None):
         self.logger = module_logger.getChild(self.__class__.__name__)
         self.logger.debug(f"Initializing {self}")
@@ -46,14 +225,12 @@ class APIWrapper:
             self.api_key = api_key
         else:
             for name in self.API_KEY_NAMES:
-                self.logger.debug(
-                    "Environment variables:\n" +
-                    '\n'.join((f"{k}: {v}" for k, v in environ.items())))
-                if name in environ:
+                api_key = environ.get(name)
+                if api_key is not None:
                     self.logger.debug(
                         f"Setting API key from environment variable {name}")
                     self.api_key_name = name
-                    self.api_key = environ[name]
+                    self.api_key = api_key
                     break
             if self.api_key is None: raise Exception(
                 f"Missing API key: no value or key file provided, and "
@@ -79,26 +256,28 @@ class OpenAIWrapper(APIWrapper):
     RATE_EXCEPTIONS: tuple[Exception] = (RateLimitError,)
     TIMEOUT_EXCEPTIONS: tuple[Exception] = (APITimeoutError,)
 
-    def __init__(self, api_key: str | None = None):
-        super().__init__(api_key=api_key)
-        self._client = OpenAI(api_key=self.api_key)
+    @property
+    def client(self) -> OpenAI:
+        """Client shared for API key (see openai_client)"""
+        return openai_client(self.api_key)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Asynchronous client shared in running loop (see async_openai_client)"""
+        return async_openai_client(self.api_key)
 
     def all_models(self) -> dict[str: dict] | None:
         return {
             m.id: Model(m.id, datetime.fromtimestamp(m.created), m.owned_by)
-            for m in self._client.models.list().data}
+            for m in self.client.models.list().data}
 
-    def complete_chat(
-            self, model: str, messages: list[Message],
-            max_tokens: int | None = None, temperature: float | None = None, top_p: float | None = None,
-            choices: int | None = None,
-            timeout: float | None = None, retries: int = 0,
-            base_delay: float = 1, jitter: bool = True, spread_factor: float = 0.5,
-            backoff: bool = True, backoff_base: float = 2,
-            call_id: str | int | None = None) -> (dict, Any):
-        """Chat completion """
-
-        self.logger.debug(f"Complete chat with {self}")
+    @staticmethod
+    def _create_request(
+            model: str, messages: list[Message],
+            max_tokens: int | None, temperature: float | None,
+            top_p: float | None, choices: int | None,
+            timeout: float | None) -> (dict, dict, str):
+        """Create request, client options and additional log message"""
 
         # TODO: Test all variables, again!
 
@@ -120,6 +299,37 @@ class OpenAIWrapper(APIWrapper):
         options = {'max_retries': 0}
         if timeout is not None: options['timeout'] = timeout
 
+        return request, options, log_message
+
+    @staticmethod
+    def _rate_buckets(
+            model: str, messages: list[Message],
+            max_tokens: int | None, choices: int | None
+            ) -> tuple[tuple[TokenBucket, int], ...]:
+        """Return rate limits buckets for model with amount to acquire"""
+        rpm_bucket, tpm_bucket = _model_buckets(model)
+        buckets = []
+        if rpm_bucket is not None: buckets.append((rpm_bucket, 1))
+        if tpm_bucket is not None:
+            buckets.append((
+                tpm_bucket, estimate_tokens(messages, max_tokens, choices)))
+        return tuple(buckets)
+
+    def complete_chat(
+            self, model: str, messages: list[Message],
+            max_tokens: int | None = None, temperature: float | None = None, top_p: float | None = None,
+            choices: int | None = None,
+            timeout: float | None = None, retries: int = 0,
+            base_delay: float = 1, jitter: bool = True, spread_factor: float = 0.5,
+            backoff: bool = True, backoff_base: float = 2,
+            call_id: str | int | None = None) -> (dict, Any):
+        """Chat completion """
+
+        self.logger.debug(f"Complete chat with {self}")
+
+        request, options, log_message = self._create_request(
+            model, messages, max_tokens, temperature, top_p, choices, timeout)
+
         # Create function call with decorator
         @retry(
             retries=retries,
@@ -128,11 +338,122 @@ class OpenAIWrapper(APIWrapper):
             base_delay=base_delay, jitter=jitter, spread_factor=spread_factor,
             backoff=backoff, backoff_base=backoff_base,
             call_id=call_id, log_messages=(log_message,))
-        def retry_create_chat_completion():
-            return self._client.with_options(**options).chat.completions.create(**request)
+        def retry_create_chat_completion(request, buckets):
+            for bucket, amount in buckets: bucket.acquire(amount)
+            try:
+                return self.client.with_options(**options).chat.completions.create(**request)
+            except self.RATE_EXCEPTIONS as e:
+                for bucket, _ in buckets: bucket.penalize()
+                raise e
 
         # Return request and response:
-        return request, retry_create_chat_completion()
+        coalescer = _COALESCER
+        if coalescer is None or choices is not None:
+            buckets = self._rate_buckets(model, messages, max_tokens, choices)
+            return request, retry_create_chat_completion(request, buckets)
+
+        # Coalesced request and response with the choice of this completion
+        def create_batch_chat_completion(size: int):
+            batch_request = dict(request, n=size) if size > 1 else request
+            buckets = self._rate_buckets(model, messages, max_tokens, size)
+            return batch_request, retry_create_chat_completion(batch_request, buckets)
+
+        key = self._request_key(messages, request, options)
+        (request, response), index = coalescer.call(key, create_batch_chat_completion)
+        return request, self._select_choice(response, index)
+
+    def stream_chat(
+            self, model: str, messages: list[Message],
+            max_tokens: int | None = None, temperature: float | None = None, top_p: float | None = None,
+            timeout: float | None = None, retries: int = 0,
+            base_delay: float = 1, jitter: bool = True, spread_factor: float = 0.5,
+            backoff: bool = True, backoff_base: float = 2,
+            call_id: str | int | None = None) -> Iterator[str]:
+        """Chat completion streamed, yield parts of content as they arrive
+
+        Only the request (until the stream starts) is retried. The stream (and
+        its connection) is closed when the generator is closed.
+        """
+
+        self.logger.debug(f"Stream chat with {self}")
+
+        buckets = self._rate_buckets(model, messages, max_tokens, None)
+        request, options, log_message = self._create_request(
+            model, messages, max_tokens, temperature, top_p, None, timeout)
+
+        # Create function call with decorator
+        @retry(
+            retries=retries,
+            rate_exceptions=self.RATE_EXCEPTIONS,
+            timeout_exceptions=self.TIMEOUT_EXCEPTIONS,
+            base_delay=base_delay, jitter=jitter, spread_factor=spread_factor,
+            backoff=backoff, backoff_base=backoff_base,
+            call_id=call_id, log_messages=(log_message,))
+        def retry_create_chat_completion_stream():
+            for bucket, amount in buckets: bucket.acquire(amount)
+            try:
+                return self.client.with_options(**options).chat.completions.create(
+                    **request, stream=True)
+            except self.RATE_EXCEPTIONS as e:
+                for bucket, _ in buckets: bucket.penalize()
+                raise e
+
+        # Yield content of chunks (stream closed if consumer stops early)
+        with retry_create_chat_completion_stream() as stream:
+            for chunk in stream:
+                choices = chunk.choices
+                if choices:
+                    content = choices[0].delta.content
+                    if content: yield content
+
+    def _request_key(self, messages: list[Message], request: dict, options: dict) -> tuple:
+        """Return hashable key of request (without serializing messages)"""
+        return (
+            self.api_key, tuple(messages),
+            tuple(sorted((k, v) for k, v in request.items() if k != 'messages')),
+            tuple(sorted(options.items())))
+
+    @staticmethod
+    def _select_choice(response, index: int):
+        """Return copy of response with only one choice (re-indexed)"""
+        if len(response.choices) == 1: return response
+        choice = response.choices[index].model_copy(update={'index': 0})
+        return response.model_copy(update={'choices': [choice]})
+
+    async def acomplete_chat(
+            self, model: str, messages: list[Message],
+            max_tokens: int | None = None, temperature: float | None = None, top_p: float | None = None,
+            choices: int | None = None,
+            timeout: float | None = None, retries: int = 0,
+            base_delay: float = 1, jitter: bool = True, spread_factor: float = 0.5,
+            backoff: bool = True, backoff_base: float = 2,
+            call_id: str | int | None = None) -> (dict, Any):
+        """Chat completion (asynchronous), see complete_chat"""
+
+        self.logger.debug(f"Complete chat asynchronously with {self}")
+
+        buckets = self._rate_buckets(model, messages, max_tokens, choices)
+        request, options, log_message = self._create_request(
+            model, messages, max_tokens, temperature, top_p, choices, timeout)
+
+        # Create coroutine function call with decorator
+        @retry(
+            retries=retries,
+            rate_exceptions=self.RATE_EXCEPTIONS,
+            timeout_exceptions=self.TIMEOUT_EXCEPTIONS,
+            base_delay=base_delay, jitter=jitter, spread_factor=spread_factor,
+            backoff=backoff, backoff_base=backoff_base,
+            call_id=call_id, log_messages=(log_message,))
+        async def retry_create_chat_completion():
+            for bucket, amount in buckets: await bucket.async_acquire(amount)
+            try:
+                return await self.async_client.with_options(**options).chat.completions.create(**request)
+            except self.RATE_EXCEPTIONS as e:
+                for bucket, _ in buckets: bucket.penalize()
+                raise e
+
+        # Return request and response:
+        return request, await retry_create_chat_completion()
 
 
 class AnthropicWrapper(APIWrapper):
@@ -152,10 +473,5 @@ class AnthropicWrapper(APIWrapper):
 # Models
 # ------
 
-MODEL_TO_APIWRAPPER: dict[str: APIWrapper] = {}
-for api_wrapper in (OpenAIWrapper, AnthropicWrapper):
-    for model in api_wrapper.MODELS:
-        if model in MODEL_TO_APIWRAPPER:
-            raise KeyError(f"Model '{model}' already exists.")
-        else:
-            MODEL_TO_APIWRAPPER[model] = api_wrapper
+# Frozen (read-only) view of API wrapper classes by model
+MODEL_TO_APIWRAPPER: MappingProxyType = MappingProxyType(_MODEL_TO_APIWRAPPER)
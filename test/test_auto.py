@@ -0,0 +1,75 @@
+"""
+Auto test module
+
+"""
+
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Timer
+from time import monotonic
+from os import link
+
+from gramolang.auto import DirectoryWatcher, watch_pool_files
+
+
+class DirectoryWatcherCase(unittest.TestCase):
+
+    def check_wake(self, watcher: DirectoryWatcher):
+        """Test wake ends the next wait (before its timeout)"""
+        watcher.wake()
+        watcher.wake()
+        start = monotonic()
+        watcher.wait(10)
+        self.assertLess(monotonic() - start, 5)
+
+    def test_inotify(self):
+        """Test wait for written file, wake up or timeout"""
+        with TemporaryDirectory() as root, DirectoryWatcher(Path(root)) as watcher:
+            if watcher._fd is None: self.skipTest("No inotify")
+            self.check_wake(watcher)
+            Timer(0.05, Path(root, 'new.xlsx').write_bytes, (b'',)).start()
+            self.assertTrue(watcher.wait(10))
+            self.assertTrue(watcher.wait(0))
+            watcher.wake()
+            self.assertFalse(watcher.wait(10))
+
+    def test_polling(self):
+        """Test wait without inotify (e.g. on Windows)"""
+        with (
+                patch('gramolang.auto.CDLL', side_effect=OSError),
+                TemporaryDirectory() as root,
+                DirectoryWatcher(Path(root)) as watcher):
+            self.assertIsNone(watcher._fd)
+            self.check_wake(watcher)
+            self.assertTrue(watcher.wait(0))
+        watcher.wake()  # No error once closed
+
+
+class WatchPoolFilesCase(unittest.TestCase):
+
+    def test_watch_pool_files(self):
+        """Test files without inotify event (hard link) are pooled on timeout"""
+
+        class Completed(Exception): pass
+
+        def complete_remove_file(path, new_path, **kwargs):
+            raise Completed(path.name)
+
+        with TemporaryDirectory() as root:
+            path = Path(root, 'linked.xlsx')
+            path.write_bytes(b'')
+            in_dir = Path(root, 'in')
+            timers = (
+                Timer(0.2, link, (path, in_dir / path.name)),
+                Timer(10, Path(in_dir, 'timeout.xlsx').write_bytes, (b'',)))
+            for timer in timers: timer.start()
+            try:
+                with (
+                        patch('gramolang.auto.complete_remove_file', complete_remove_file),
+                        self.assertRaises(Completed) as context):
+                    watch_pool_files(root, status_delay=None, refresh_delay=0.05)
+            finally:
+                for timer in timers: timer.cancel()
+        self.assertTrue(str(context.exception).endswith(' linked.xlsx'))
@@ -0,0 +1,180 @@
+"""
+Chat test module
+
+"""
+
+import unittest
+from types import SimpleNamespace
+from asyncio import run, sleep, gather
+
+from gramolang.common import Role
+from gramolang.wraipi import (
+    OpenAIWrapper, _RPM_BUCKETS, _SHARED_CALL_BUCKETS, _model_buckets,
+    set_rate_limits)
+from gramolang.chat import Chat, BatchCommand, complete_many, parse_json_strings
+
+
+def response(*contents):
+    """Return completion response with a choice for each content"""
+    return SimpleNamespace(choices=[
+        SimpleNamespace(message=SimpleNamespace(content=c)) for c in contents])
+
+
+class StubWrapper:
+    """API wrapper replying with the content of the last message (upper case)"""
+
+    def __init__(self):
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.rpm_buckets = []
+
+    def complete_chat(self, model, messages, **kwargs):
+        self.calls.append(messages)
+        return {'model': model}, response(messages[-1].content.upper())
+
+    def stream_chat(self, model, messages, **kwargs):
+        self.calls.append(messages)
+        yield from messages[-1].content.upper()
+
+    async def acomplete_chat(self, model, messages, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        self.rpm_buckets.append(_model_buckets(model)[0])
+        await sleep(0)
+        self.active -= 1
+        return self.complete_chat(model, messages, **kwargs)
+
+
+def create_chat(api_wrapper, model='gpt-4') -> Chat:
+    chat = Chat(api_wrappers={OpenAIWrapper: api_wrapper})
+    chat.model(model)
+    return chat
+
+
+class ChatCase(unittest.TestCase):
+
+    def test_window_messages(self):
+        """Test window_messages method"""
+        chat = create_chat(StubWrapper())
+        chat.append_system_message('system')
+        for i in range(6): chat.append_user_message(str(i))
+        self.assertEqual(7, len(chat.window_messages()))
+
+        # Leading system messages and last window to 2 x window messages
+        chat.parse_execute('window 2')
+        self.assertEqual(
+            ['system', '2', '3', '4', '5'], [m.content for m in chat.window_messages()])
+        chat.append_user_message('6')
+        self.assertEqual(
+            ['system', '4', '5', '6'], [m.content for m in chat.window_messages()])
+        chat.append_user_message('7')
+        self.assertEqual(
+            ['system', '4', '5', '6', '7'], [m.content for m in chat.window_messages()])
+
+        # Window start follows window changes
+        chat.window = 3
+        self.assertEqual(
+            ['system', '3', '4', '5', '6', '7'], [m.content for m in chat.window_messages()])
+        chat.window = None
+        self.assertEqual(9, len(chat.window_messages()))
+
+    def test_parse_json_strings(self):
+        """Test parse_json_strings function"""
+        self.assertEqual(['a', 'b'], parse_json_strings('["a", "b"]', 2))
+        self.assertEqual(
+            ['[0] a]', 'b'], parse_json_strings('Sure: ["[0] a]", "b"] [x]', 2))
+        self.assertEqual(['a'], parse_json_strings('[1] ["a"]', 1))
+        for content in ('No array', '["a"]', '["a", 1]', '{"a": "b"}', '', None):
+            with self.assertRaises(ValueError): parse_json_strings(content, 2)
+
+    def test_batch_complete(self):
+        """Test batch_complete method"""
+        api_wrapper = StubWrapper()
+        chat = create_chat(api_wrapper)
+        chat.append_system_message('Classify.')
+        api_wrapper.complete_chat = lambda model, messages, **kwargs: (
+            {}, response('```json\n["POS", "NEG"]\n```'))
+        self.assertEqual(['POS', 'NEG'], chat.execute(BatchCommand('I love it\nMeh')))
+        self.assertEqual(['POS', 'NEG'], chat.parse_execute('batch I love it\nMeh'))
+        self.assertEqual(['POS', 'NEG'], chat.parse_execute('batch: a: b\nc'))
+        self.assertEqual(['POS', 'NEG'], chat.batch_complete_lines('\n a \n\nb\n'))
+        with self.assertRaises(ValueError): chat.batch_complete(['a'])
+        self.assertEqual(1, len(chat.messages))
+
+        # Whole argument string as message (separators and quotes included)
+        chat.parse_execute('user Translate: "hello world"')
+        self.assertEqual('Translate: "hello world"', chat.messages[-1].content)
+
+    def test_complete(self):
+        """Test complete and acomplete methods"""
+        api_wrapper = StubWrapper()
+        chat = create_chat(api_wrapper)
+        chat.parse_execute('user hi')
+        request, response = chat.parse_execute('assistant')
+        self.assertEqual({'model': 'gpt-4'}, request)
+        self.assertEqual('HI', chat.last_assistant_message())
+
+        # Asynchronous completion (with command)
+        chat.append_user_message('hello')
+        run(chat.aparse_execute('acomplete'))
+        self.assertEqual('HELLO', chat.last_assistant_message())
+        run(chat.acomplete(append_completion=False))
+        self.assertEqual(4, len(chat.messages))
+        self.assertEqual(3, len(api_wrapper.calls))
+
+    def test_complete_stream(self):
+        """Test complete_stream method"""
+        chat = create_chat(StubWrapper())
+        chat.append_user_message('hi')
+        stream = chat.complete_stream()
+        self.assertEqual('H', next(stream))
+        self.assertEqual(1, len(chat.messages))
+        self.assertEqual(['I'], list(stream))
+        self.assertEqual('HI', chat.last_assistant_message())
+        self.assertEqual(['H', 'I'], list(chat.complete_stream(append_completion=False)))
+        self.assertEqual(2, len(chat.messages))
+
+    def test_complete_many(self):
+        """Test complete_many function"""
+
+        api_wrapper = StubWrapper()
+        chats = [create_chat(api_wrapper) for _ in range(5)]
+        for i, chat in enumerate(chats): chat.append_user_message(f"q{i}")
+
+        # Completions appended, at most max. concurrency in progress
+        results = run(complete_many(chats, max_concurrency=2))
+        self.assertEqual(['Q0', 'Q1', 'Q2', 'Q3', 'Q4'], [c.last_assistant_message() for c in chats])
+        self.assertEqual('Q0', results[0][1].choices[0].message.content)
+        self.assertEqual(2, api_wrapper.max_active)
+
+        # Rate limits only during the call (previous limits restored)
+        set_rate_limits('gpt-4', requests_per_minute=60)
+        bucket = _RPM_BUCKETS['gpt-4']
+        api_wrapper.rpm_buckets.clear()
+        try:
+            run(complete_many(chats, requests_per_minute=6000, append_completion=False))
+            self.assertEqual(6000, api_wrapper.rpm_buckets[0].capacity)
+            self.assertIs(bucket, _RPM_BUCKETS['gpt-4'])
+
+            # Overlapping calls with their own limits (or the same bucket)
+            async def overlapping():
+                return await gather(*(
+                    complete_many(chats[:1], requests_per_minute=rpm, append_completion=False)
+                    for rpm in (100, 200, 100, 60)))
+            api_wrapper.rpm_buckets.clear()
+            run(overlapping())
+            rpm_buckets = api_wrapper.rpm_buckets
+            self.assertEqual([100, 200, 100, 60], [b.capacity for b in rpm_buckets])
+            self.assertIs(rpm_buckets[0], rpm_buckets[2])
+            self.assertIs(bucket, rpm_buckets[3])
+            self.assertIs(bucket, _RPM_BUCKETS['gpt-4'])
+            self.assertEqual({}, _SHARED_CALL_BUCKETS)
+        finally:
+            set_rate_limits('gpt-4')
+        self.assertEqual(1, len(chats[0].role_messages(Role.ASSISTANT)))
+
+        # Exceptions returned (not raised) if requested (no message to complete)
+        results = run(complete_many(
+            [create_chat(api_wrapper)], return_exceptions=True))
+        self.assertIsInstance(results[0], IndexError)
@@ -0,0 +1,132 @@
+"""
+Command test module
+
+"""
+
+import unittest
+from asyncio import run
+
+from gramolang.command import (
+    Command, EmptyCommand, UnaryCommand, ToggleCommand, Commands,
+    CommandError, CommandClassError, split_arguments)
+
+
+class AddCommand(Command):
+    """Add numbers."""
+    __slots__ = ()
+    NAMES = ('add', 'plus')
+
+    def __init__(self, *args, name=NAMES[0]) -> None:
+        super().__init__(*args, name=name)
+
+
+class ValueCommand(UnaryCommand):
+    """Set/get value."""
+    __slots__ = ()
+    NAMES = ('value',)
+
+
+class ClearCommand(EmptyCommand):
+    """Clear value."""
+    __slots__ = ()
+    NAMES = ('clear',)
+
+
+class AsyncCommand(EmptyCommand):
+    """Clear value asynchronously."""
+    __slots__ = ()
+    NAMES = ('aclear',)
+
+
+class VerboseCommand(ToggleCommand):
+    """Toggle verbose."""
+    __slots__ = ()
+    NAMES = ('verbose',)
+
+
+class Target:
+
+    def __init__(self):
+        self.value = None
+        self.verbose = False
+
+    def add(self, *args):
+        """Return sum of numbers."""
+        return sum(map(float, args))
+
+    def clear(self): self.value = None  # Summary from command class (no docstring)
+
+    async def aclear(self): self.value = None
+
+    def toggle_verbose(self, set_value: bool | None = None):
+        self.verbose = not self.verbose if set_value is None else set_value
+        return self.verbose
+
+    commands = Commands(
+        {AddCommand: add, ValueCommand: 'value', ClearCommand: clear},
+        {AsyncCommand: aclear, VerboseCommand: toggle_verbose})
+
+
+class CommandCase(unittest.TestCase):
+
+    def test_split_arguments(self):
+        """Test split_arguments function"""
+        self.assertEqual(('a', 'b'), split_arguments(' a  b '))
+        self.assertEqual(('a b', 'c'), split_arguments('"a b" c'))
+        self.assertEqual(('say "hi"',), split_arguments(r'"say \"hi\""'))
+        self.assertEqual(('',), split_arguments('""'))
+        self.assertEqual((), split_arguments(''))
+
+    def test_dispatch(self):
+        """Test Commands lookups by class, instance and name"""
+        commands = Target.commands
+        for key in (AddCommand, AddCommand(), 'add', 'PLUS'):
+            self.assertIn(key, commands)
+            self.assertIs(AddCommand, commands[key])
+        self.assertNotIn('unknown', commands)
+        with self.assertRaises(CommandClassError): commands['unknown']
+        with self.assertRaises(CommandClassError): commands[UnaryCommand]
+        self.assertEqual('Return sum of numbers.', commands.summary('add'))
+        self.assertEqual('clear: Clear value.', commands.write_command_help(ClearCommand))
+
+        # Duplicate classes or names
+        with self.assertRaises(CommandError): Commands({AddCommand: 'a'}, {AddCommand: 'b'})
+        class OtherCommand(EmptyCommand):
+            NAMES = ('plus',)
+        with self.assertRaises(CommandError): Commands({AddCommand: 'a', OtherCommand: 'b'})
+
+    def test_parse(self):
+        """Test Commands parse method"""
+        commands = Target.commands
+        command = commands.parse(' Plus ')
+        self.assertIsInstance(command, AddCommand)
+        self.assertEqual(('plus', ()), (command.name, command.args))
+        self.assertEqual(('1', '2.5'), commands.parse('add 1 2.5').args)
+        self.assertEqual(('1', '2'), commands.parse('add: 1 2').args)
+        self.assertEqual(('a b',), commands.parse('value = a b').args)
+        self.assertEqual((None,), commands.parse('value \\none').args)
+        self.assertEqual((False,), commands.parse('verbose false').args)
+        with self.assertRaises(CommandClassError): commands.parse('unknown 1')
+
+    def test_execute(self):
+        """Test Commands execute methods (results returned)"""
+        target = Target()
+        self.assertEqual(3.5, target.commands.parse_instance_execute(target, 'add 1 2.5'))
+        self.assertEqual(3, target.commands.instance_execute(target, AddCommand(1, 2)))
+        target.commands.parse_instance_execute(target, 'value 1')
+        self.assertEqual('1', target.commands.instance_execute(target, ValueCommand))
+        target.commands.instance_execute(target, 'clear')
+        self.assertIsNone(target.value)
+        self.assertTrue(target.commands.instance_execute(target, VerboseCommand()))
+        self.assertFalse(target.commands.parse_instance_execute(target, 'verbose'))
+        self.assertEqual((), ValueCommand().args)
+
+        # Asynchronous commands only executed asynchronously
+        target.value = 1
+        for command in (AsyncCommand(), AsyncCommand, 'aclear'):
+            with self.assertRaisesRegex(CommandError, 'AsyncCommand is asynchronous'):
+                target.commands.instance_execute(target, command)
+        self.assertEqual(1, target.value)
+        run(target.commands.aparse_instance_execute(target, 'aclear'))
+        self.assertIsNone(target.value)
+        self.assertEqual(3, run(target.commands.ainstance_execute(target, 'add 1 2')))
@@ -4,11 +4,17 @@ Main test module
 """
 
 import unittest
+from unittest.mock import patch
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from tempfile import TemporaryDirectory
+from datetime import timedelta
 
 from gramolang.common import (
-    NAME_VALUE_SEPS, SPACE_SEP, parse_name_value,
-    get_file_variable)
+    NAME_VALUE_SEPS, SPACE_SEP, parse_name_value, FileType,
+    TokenBucket, Coalescer, write_error, retry,
+    ensure_dir, write_new_filename, remove_dir_entries, write_timedelta)
 
 
 class MainCase(unittest.TestCase):
@@ -73,6 +79,185 @@ class MainCase(unittest.TestCase):
             ('name', f'{sep0} {sep1}arguments'),
             parse_name_value(f"name{sep1}{sep0} {sep1}arguments"))
 
+        # Single name: separators in arguments (after a space) kept in value
+        for sep in NAME_VALUE_SEPS:
+            self.assertEqual(
+                ('name', f"C{sep}\\x.txt"),
+                parse_name_value(f"name C{sep}\\x.txt", single_name=True))
+            self.assertEqual(
+                ('name', f"a{sep} b"), parse_name_value(f"name {sep} a{sep} b", single_name=True))
+
+    def test_file_type(self):
+        """Test FileType class"""
+        self.assertIs(FileType.TEXT, FileType.from_extension('.txt'))
+        self.assertIs(FileType.CSV, FileType.from_extension('.csv'))
+        self.assertIs(FileType.EXCEL, FileType.from_extension('.xlsx'))
+        self.assertIs(FileType.CSV, FileType.from_path(Path('a', 'b.csv')))
+        self.assertEqual('Text', FileType.TEXT)
+        with self.assertRaises(Exception): FileType.from_extension('.pdf')
+
+    def test_write_timedelta(self):
+        """Test write_timedelta function"""
+        self.assertEqual('1.5 s', write_timedelta(timedelta(seconds=1.5), 1))
+        self.assertEqual('1.23 s', write_timedelta(1.2345, 2))
+        self.assertEqual('2 s', write_timedelta(2))
+
+    def test_write_error(self):
+        """Test write_error function"""
+        e = ValueError('bad')
+        self.assertEqual('ValueError: bad', write_error(e))
+        self.assertEqual('ValueError after 2 s: bad', write_error(e, delta=timedelta(seconds=2)))
+        self.assertEqual(
+            'Error with a after 2 s: ValueError: bad: Re-raising...',
+            write_error(e, 'a', timedelta(seconds=2), re_raise=True))
+
+    def test_retry(self):
+        """Test retry function decorator"""
+
+        # No retry: function is not decorated
+        def func(): return 1
+        self.assertIs(func, retry()(func))
+
+        # Retry on timeout exception until success
+        calls = []
+        @retry(retries=2, timeout_exceptions=(TimeoutError,), base_delay=0)
+        def timeout():
+            calls.append(None)
+            if len(calls) < 3: raise TimeoutError()
+            return len(calls)
+        self.assertEqual(3, timeout())
+
+        # Re-raise when no retry left
+        calls.clear()
+        @retry(retries=1, timeout_exceptions=(TimeoutError,), base_delay=0)
+        def fail():
+            calls.append(None)
+            raise TimeoutError()
+        with self.assertRaises(TimeoutError): fail()
+        self.assertEqual(2, len(calls))
+
+    def test_token_bucket(self):
+        """Test TokenBucket class"""
+
+        # Fake clock and sleep (no wall-clock timing)
+        clock = [0.]
+        with patch('gramolang.common.monotonic', lambda: clock[0]), \
+                patch('gramolang.common.sleep') as sleep:
+
+            # Full bucket on creation
+            bucket = TokenBucket(rate=100, capacity=2)
+            self.assertEqual(0, bucket.acquire())
+            self.assertEqual(0, bucket.acquire())
+            sleep.assert_not_called()
+
+            # Wait for refill when empty (debt of 1 token at 100 tokens/s)
+            self.assertAlmostEqual(0.01, bucket.acquire())
+            self.assertAlmostEqual(0.01, sleep.call_args.args[0])
+
+            # Amount capped to capacity (debt of 1 + 2 tokens)
+            self.assertAlmostEqual(0.03, bucket.reserve(10))
+
+            # Refill with time up to capacity
+            clock[0] += 1
+            self.assertEqual(0, bucket.reserve(2))
+            self.assertAlmostEqual(0.01, bucket.reserve())
+
+        # Penalize decreases rate down to min. rate
+        bucket = TokenBucket(rate=100, min_rate_factor=0.3)
+        bucket.penalize()
+        self.assertEqual(50, bucket.rate)
+        bucket.penalize()
+        self.assertEqual(30, bucket.rate)
+
+        # Acquire increases rate up to max. rate
+        bucket.acquire()
+        self.assertEqual(31, bucket.rate)
+
+        # Per minute limit
+        bucket = TokenBucket.per_minute(600)
+        self.assertEqual(10, bucket.rate)
+        self.assertEqual(600, bucket.capacity)
+
+    def test_coalescer(self):
+        """Test Coalescer class"""
+
+        sizes = []
+        def func(size):
+            sizes.append(size)
+            return size
+
+        # Lone call doesn't wait for the window
+        coalescer = Coalescer(window=60)
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(coalescer.call, 'key', func)
+            self.assertEqual((1, 0), future.result(timeout=5))
+
+        # Other call in progress (blocked) to keep the coalescer active, batches
+        # closed by size (not by the window)
+        coalescer = Coalescer(window=60, max_batch=3)
+        started, release = Event(), Event()
+        def block(size):
+            started.set()
+            release.wait()
+            return size
+
+        # Identical concurrent calls in batches of max. size
+        sizes.clear()
+        with ThreadPoolExecutor(7) as executor:
+            blocked = executor.submit(coalescer.call, 'other', block)
+            started.wait()
+            results = list(executor.map(lambda _: coalescer.call('key', func), range(6)))
+            release.set()
+            self.assertEqual((1, 0), blocked.result())
+        self.assertEqual([3, 3], sizes)
+        self.assertEqual([0, 0, 1, 1, 2, 2], sorted(i for _, i in results))
+
+        # Exception raised for each call of the batch (a copy for other calls)
+        errors = []
+        def fail(size): raise ValueError(size)
+        def call(_):
+            try: coalescer.call('key', fail)
+            except ValueError as e: errors.append(e)
+        started.clear()
+        release.clear()
+        with ThreadPoolExecutor(4) as executor:
+            blocked = executor.submit(coalescer.call, 'other', block)
+            started.wait()
+            list(executor.map(call, range(3)))
+            release.set()
+        self.assertEqual(3, len(errors))
+        self.assertEqual(3, len({id(e) for e in errors}))
+        self.assertEqual([(3,)] * 3, [e.args for e in errors])
+
+    def test_write_new_filename(self):
+        """Test write_new_filename function"""
+        with TemporaryDirectory() as dir1, TemporaryDirectory() as dir2:
+            self.assertEqual('a.xlsx', write_new_filename('a.xlsx', dir1, dir2))
+            Path(dir1, 'a.xlsx').touch()
+            Path(dir2, 'a [1].xlsx').touch()
+            self.assertEqual('a [2].xlsx', write_new_filename('a.xlsx', dir1, Path(dir2)))
+            Path(dir1, 'a [2].xlsx').touch()
+            self.assertEqual('a [3].xlsx', write_new_filename('a.xlsx', dir1, Path(dir2), Path(dir2, 'x')))
+
+    def test_ensure_dir(self):
+        """Test ensure_dir function"""
+        with TemporaryDirectory() as root:
+            path = Path(root, 'a', 'b')
+            self.assertEqual(path, ensure_dir(path))
+            self.assertTrue(path.is_dir())
+            self.assertEqual(path, ensure_dir(path))
+            Path(root, 'c').touch()
+            with self.assertRaises(NotADirectoryError): ensure_dir(Path(root, 'c'))
+
+    def test_remove_dir_entries(self):
+        """Test remove_dir_entries function"""
+        with TemporaryDirectory() as root:
+            Path(root, 'a', 'b').mkdir(parents=True)
+            Path(root, 'a', 'b', 'c.txt').touch()
+            Path(root, 'd.txt').touch()
+            remove_dir_entries(Path(root))
+            self.assertEqual([], list(Path(root).iterdir()))
+
     @unittest.skip
     def test_get_file_variable(self):
         # TODO: Add tests for getting file variables for API keys
@@ -0,0 +1,31 @@
+"""
+Console test module
+
+"""
+
+import unittest
+from unittest.mock import patch
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from gramolang.wraipi import OpenAIWrapper
+from gramolang.chat import Chat
+from gramolang.console import Console
+
+
+class ConsoleCase(unittest.TestCase):
+
+    def test_batch(self):
+        """Test batch command with file path (spaces and separators included)"""
+        console = Console(api_keys={OpenAIWrapper: 'key'})
+        console.OUTPUT_FILE = StringIO()
+        console._running = True
+        with (
+                patch.object(Chat, 'batch_complete_lines', lambda self, text: text.upper().splitlines()),
+                TemporaryDirectory() as root):
+            path = Path(root, 'my file: x.txt')
+            path.write_text('a\nb', encoding='utf-8')
+            console.parse_execute(f"batch {path}")
+            console.parse_execute(f"batch: {path}")
+        self.assertEqual('[0] A\n[1] B\n' * 2, console.OUTPUT_FILE.getvalue())
@@ -0,0 +1,151 @@
+"""
+Sheet test module
+
+"""
+
+import unittest
+from unittest.mock import patch
+from types import SimpleNamespace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from json import dumps
+from asyncio import run, sleep
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+from gramolang.wraipi import (
+    OpenAIWrapper, _RPM_BUCKETS, _TPM_BUCKETS, _model_buckets, set_rate_limits)
+from gramolang.chat import Chat
+from gramolang import sheet
+
+
+def complete_chat(self, model, messages, **kwargs):
+    """Reply with content of last message in upper case (one per batch item)"""
+    content = messages[-1].content
+    if content.startswith(Chat.BATCH_PROMPT):
+        items = content.splitlines()[1:]
+        content = dumps([i.split('] ', 1)[1].upper() for i in items])
+    else: content = content.upper()
+    message = SimpleNamespace(content=content)
+    return {'model': model}, SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+async def acomplete_chat(self, model, messages, **kwargs):
+    return complete_chat(self, model, messages, **kwargs)
+
+
+def write_workbook(path: Path) -> None:
+    wb = Workbook()
+    sheet = wb.active
+    sheet.title = 'Test'
+    for row in (
+            ('Param', 'Column 1', 'Column 2', '#Column 3'),
+            ('user', 'hi', 'hello', 'skipped'),
+            ('assistant', None, None, None),
+            ('batch', '/etc/hostname\nb', 'c', None),
+            ('unknown', 'x', 'y', None)):
+        sheet.append(row)
+    wb.create_sheet('#Skipped').append(('Param', 'Column'))
+    wb.save(path)
+
+
+class SheetCase(unittest.TestCase):
+
+    def test_complete(self):
+        """Test complete function"""
+        with TemporaryDirectory() as root:
+            path, new_path = Path(root, 'test.xlsx'), Path(root, 'new.xlsx')
+            write_workbook(path)
+            with (
+                    patch.object(OpenAIWrapper, 'complete_chat', complete_chat),
+                    patch.object(sheet, 'COMPLETE_FONT', Font(italic=True))):
+                exceptions = sheet.complete(
+                    path, new_path, api_keys={OpenAIWrapper: 'key'}, model='gpt-4')
+
+            # Completions and batch responses (cell lines, not a file) written
+            ws = load_workbook(new_path)['Test']
+            self.assertEqual(
+                [('HI', 'HELLO', None), ('/ETC/HOSTNAME\nB', 'C', None)],
+                [tuple(c.value for c in ws[row][1:]) for row in (3, 4)])
+
+            # Unknown command errors in cells
+            self.assertEqual(2, len(exceptions))
+            self.assertIn('unknown', ws['B5'].value)
+            self.assertTrue(ws['B5'].font.bold)
+
+            # Module fonts (replaceable openpyxl fonts)
+            self.assertTrue(ws['B3'].font.italic)
+            self.assertIsInstance(sheet.ERROR_FONT, Font)
+
+    def test_complete_rate_limits(self):
+        """Test complete function rate limits (only given ones, in the call)"""
+        buckets = []
+        def rate_complete_chat(self, model, messages, **kwargs):
+            buckets.append(_model_buckets(model))
+            return complete_chat(self, model, messages, **kwargs)
+
+        set_rate_limits('gpt-4', requests_per_minute=60, tokens_per_minute=1000)
+        rpm_bucket, tpm_bucket = _RPM_BUCKETS['gpt-4'], _TPM_BUCKETS['gpt-4']
+        try:
+            with TemporaryDirectory() as root:
+                path = Path(root, 'test.xlsx')
+                write_workbook(path)
+                with patch.object(OpenAIWrapper, 'complete_chat', rate_complete_chat):
+                    sheet.complete(
+                        path, api_keys={OpenAIWrapper: 'key'}, model='gpt-4',
+                        requests_per_minute=6000)
+            self.assertEqual(
+                (rpm_bucket, tpm_bucket), (_RPM_BUCKETS['gpt-4'], _TPM_BUCKETS['gpt-4']))
+        finally:
+            set_rate_limits('gpt-4')
+
+        # Requests limit of the call in each column's thread, tokens limit kept
+        self.assertEqual(4, len(buckets))
+        self.assertEqual({6000}, {rpm.capacity for rpm, _ in buckets})
+        self.assertEqual(1, len({id(rpm) for rpm, _ in buckets}))
+        self.assertEqual({id(tpm_bucket)}, {id(tpm) for _, tpm in buckets})
+
+    def test_acomplete(self):
+        """Test acomplete function (same results as complete)"""
+        with TemporaryDirectory() as root:
+            path = Path(root, 'test.xlsx')
+            write_workbook(path)
+            with patch.object(OpenAIWrapper, 'complete_chat', complete_chat):
+                sheet.complete(
+                    path, Path(root, 'new.xlsx'), api_keys={OpenAIWrapper: 'key'},
+                    model='gpt-4')
+                with patch.object(OpenAIWrapper, 'acomplete_chat', acomplete_chat):
+                    exceptions = run(sheet.acomplete(
+                        path, Path(root, 'anew.xlsx'), api_keys={OpenAIWrapper: 'key'},
+                        model='gpt-4', max_chats=1))
+            self.assertEqual(2, len(exceptions))
+            values, avalues = (
+                [[c.value for c in row] for row in load_workbook(Path(root, name))['Test']]
+                for name in ('new.xlsx', 'anew.xlsx'))
+            self.assertEqual(values, avalues)
+            self.assertEqual('HI', avalues[2][1])
+
+    def test_acomplete_cancel(self):
+        """Test acomplete function waits for cancelled columns before raising"""
+        events = []
+
+        async def acomplete_col(name, *args):
+            if name.startswith("column 'Column 1'"): raise ValueError(name)
+            try: await sleep(60)
+            except BaseException as e:
+                events.append('cancelled')
+                raise e
+
+        async def acomplete(path):
+            try: await sheet.acomplete(path, api_keys={OpenAIWrapper: 'key'}, model='gpt-4')
+            finally: events.append('raised')
+
+        with TemporaryDirectory() as root:
+            path = Path(root, 'test.xlsx')
+            write_workbook(path)
+            with (
+                    patch.object(sheet, '_acomplete_col', acomplete_col),
+                    self.assertRaises(ValueError)):
+                run(acomplete(path))
+        self.assertEqual(['cancelled', 'raised'], events)
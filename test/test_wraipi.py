@@ -0,0 +1,153 @@
+"""
+API wrapper test module
+
+"""
+
+import unittest
+from unittest.mock import patch
+from types import SimpleNamespace
+from asyncio import run, gather, get_running_loop
+
+from gramolang.common import Role, Message
+from gramolang.wraipi import (
+    OpenAIWrapper, MODEL_TO_APIWRAPPER, estimate_tokens,
+    close_openai_clients, aclose_openai_clients)
+
+
+class FakeAsyncOpenAI:
+    """Asynchronous client bound to the event loop it is created in"""
+
+    instances = []
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.loop = get_running_loop()
+        self.closed = False
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.instances.append(self)
+
+    def with_options(self, **options): return self
+
+    async def create(self, **request):
+        if self.closed or get_running_loop() is not self.loop:
+            raise RuntimeError('Event loop is closed')
+        message = SimpleNamespace(content=request['messages'][-1]['content'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def close(self): self.closed = True
+
+
+class FakeStream:
+    """Stream of chunks closed on exit of its context"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self): return iter(self.chunks)
+
+    def __enter__(self): return self
+
+    def __exit__(self, *args): self.close()
+
+    def close(self): self.closed = True
+
+
+def chunk(content: str | None = None):
+    """Return stream chunk with content (no choice if None)"""
+    choices = [] if content is None else [SimpleNamespace(delta=SimpleNamespace(content=content))]
+    return SimpleNamespace(choices=choices)
+
+
+class WraipiCase(unittest.TestCase):
+
+    def setUp(self) -> None: FakeAsyncOpenAI.instances.clear()
+
+    def test_subclass(self):
+        """Test subclasses without their own models aren't registered"""
+        class LoggingWrapper(OpenAIWrapper): pass
+        self.assertIs(OpenAIWrapper, MODEL_TO_APIWRAPPER['gpt-4'])
+        self.assertEqual(OpenAIWrapper.MODELS, LoggingWrapper.MODELS)
+
+    def test_estimate_tokens(self):
+        """Test estimate_tokens function (messages without content included)"""
+        messages = [Message(Role.USER, 'a' * 40), Message(Role.ASSISTANT, None)]
+        self.assertEqual(10 + 2 * 100, estimate_tokens(messages, 100, 2))
+
+    def test_create_request(self):
+        """Test requests don't share (mutable) message envelopes"""
+        messages = [Message(Role.USER, 'hello')]
+        request, options, _ = OpenAIWrapper._create_request(
+            'gpt-4', messages, 10, None, None, None, 5)
+        self.assertEqual(
+            {'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'hello'}],
+             'max_tokens': 10}, request)
+        self.assertEqual({'max_retries': 0, 'timeout': 5}, options)
+        request['messages'][0]['content'] = 'changed'
+        request, _, _ = OpenAIWrapper._create_request(
+            'gpt-4', messages, None, None, None, None, None)
+        self.assertEqual('hello', request['messages'][0]['content'])
+
+    def test_stream_chat(self):
+        """Test stream_chat method yields content parts and closes the stream"""
+        api_wrapper = OpenAIWrapper(api_key='key')
+        requests = []
+        streams = []
+        def create(**request):
+            requests.append(request)
+            streams.append(FakeStream((chunk('He'), chunk(''), chunk(), chunk('llo'))))
+            return streams[-1]
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        with patch(
+                'gramolang.wraipi.openai_client',
+                lambda api_key: SimpleNamespace(with_options=lambda **_: client)):
+            parts = list(api_wrapper.stream_chat('gpt-4', [Message(Role.USER, 'hi')]))
+            self.assertEqual(['He', 'llo'], parts)
+            self.assertTrue(requests[0]['stream'])
+            self.assertTrue(streams[0].closed)
+
+            # Stream closed when consumer stops early
+            stream = api_wrapper.stream_chat('gpt-4', [Message(Role.USER, 'hi')])
+            self.assertEqual('He', next(stream))
+            self.assertFalse(streams[1].closed)
+            stream.close()
+            self.assertTrue(streams[1].closed)
+
+    def test_close_clients(self):
+        """Test API wrappers get a new client after shared clients are closed"""
+        api_wrapper = OpenAIWrapper(api_key='key')
+        client = api_wrapper.client
+        self.assertIs(client, OpenAIWrapper(api_key='key').client)
+        close_openai_clients()
+        self.assertIsNot(client, api_wrapper.client)
+        close_openai_clients()
+
+    def test_async_client(self):
+        """Test asynchronous clients shared by event loop and API key"""
+
+        messages = [Message(Role.USER, 'hello')]
+        api_wrappers = [OpenAIWrapper(api_key='key') for _ in range(3)]
+
+        async def complete():
+            responses = await gather(*(
+                w.acomplete_chat('gpt-4', messages) for w in api_wrappers))
+            await aclose_openai_clients()
+            return responses
+
+        # One client for all wrappers, closed at the end of each loop
+        with patch('gramolang.wraipi.AsyncOpenAI', FakeAsyncOpenAI):
+            for i in range(2):
+                responses = run(complete())
+                self.assertEqual(
+                    ['hello'] * 3,
+                    [r.choices[0].message.content for _, r in responses])
+                self.assertEqual(i + 1, len(FakeAsyncOpenAI.instances))
+                self.assertTrue(FakeAsyncOpenAI.instances[-1].closed)
+
+            # Client not shared by other API keys
+            async def clients():
+                return (
+                    OpenAIWrapper(api_key='key').async_client,
+                    OpenAIWrapper(api_key='other').async_client)
+            client, other = run(clients())
+            self.assertIsNot(client, other)